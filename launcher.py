@@ -37,36 +37,27 @@ if TIGERTAG_DIR.exists():
 
 # Now import and run the GUI
 if __name__ == "__main__":
+    # Metadata rebuilds use worker processes, which re-enter the frozen exe
+    import multiprocessing
+    multiprocessing.freeze_support()
+    
     try:
         import tkinter as tk
         import metadata_handler
         from gui import ToolGUI
         
-        # Patch metadata_handler to use correct path when frozen
+        # Point metadata_handler at the bundled catalogue when frozen
         if getattr(sys, 'frozen', False):
-            def patched_load_parquet_folder():
-                """Load parquet files from the bundled location."""
-                if hasattr(sys, '_MEIPASS'):
-                    metadata_path = Path(sys._MEIPASS) / "metadata" / "parquet_files"
-                else:
-                    metadata_path = BASE_DIR / "metadata" / "parquet_files"
-                
-                import pandas as pd
-                datasets = {}
-                for parquet_file in metadata_path.glob('*.parquet'):
-                    key = parquet_file.stem
-                    datasets[key] = pd.read_parquet(parquet_file)
-                return datasets
-            
-            metadata_handler.load_parquet_folder = patched_load_parquet_folder
+            metadata_handler.METADATA_DIR = METADATA_DIR
         
-        from metadata_handler import load_parquet_folder
+        from metadata_handler import load_catalogues
         
         # Create root window
         root = tk.Tk()
         
-        # Load metadata
-        metadata_dict = load_parquet_folder()
+        # Index metadata (memory-mapped when the Arrow file is bundled); each
+        # orchestra is read when first selected
+        metadata_dict = load_catalogues()
         artists = metadata_dict.keys()
         
         # Create and run GUI
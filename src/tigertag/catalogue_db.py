@@ -0,0 +1,277 @@
+"""SQLite catalogue backend: indexed lookups against a catalogue kept on disk instead of in memory."""
+from __future__ import annotations
+
+import copy
+import json
+import re
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from rapidfuzz import fuzz, process  # type: ignore
+from catalogue_index import CatalogueIndex, ROW_KEY_COLUMNS, catalogue_row_key, title_trigrams
+
+# Bumped whenever SCHEMA below changes, so existing databases are rebuilt
+DB_LAYOUT = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalogue (
+    id INTEGER PRIMARY KEY,
+    catalogue TEXT NOT NULL,
+    {columns}
+);
+CREATE INDEX IF NOT EXISTS catalogue_year ON catalogue (catalogue, Year);
+CREATE INDEX IF NOT EXISTS orchestra ON catalogue (Orchestra);
+CREATE INDEX IF NOT EXISTS singer ON catalogue (Singer);
+CREATE INDEX IF NOT EXISTS year ON catalogue (Year);
+CREATE INDEX IF NOT EXISTS norm_title ON catalogue (_norm_title);
+
+-- Full-text index over the catalogue table, kept in sync by the triggers below
+CREATE VIRTUAL TABLE IF NOT EXISTS catalogue_fts USING fts5(
+    Title, Composer, Author,
+    content='catalogue', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='4'
+);
+CREATE TRIGGER IF NOT EXISTS catalogue_insert AFTER INSERT ON catalogue BEGIN
+    INSERT INTO catalogue_fts (rowid, Title, Composer, Author)
+    VALUES (new.id, new.Title, new.Composer, new.Author);
+END;
+CREATE TRIGGER IF NOT EXISTS catalogue_delete AFTER DELETE ON catalogue BEGIN
+    INSERT INTO catalogue_fts (catalogue_fts, rowid, Title, Composer, Author)
+    VALUES ('delete', old.id, old.Title, old.Composer, old.Author);
+    DELETE FROM title_trigram WHERE id = old.id;
+END;
+
+-- Trigrams of each normalised title (catalogue_index.title_trigrams), to shortlist
+-- titles sharing no word with the query
+CREATE TABLE IF NOT EXISTS title_trigram (
+    gram TEXT NOT NULL,
+    id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS title_trigram_gram ON title_trigram (gram);
+CREATE INDEX IF NOT EXISTS title_trigram_id ON title_trigram (id);
+
+-- What the database was built with: rebuilt when it no longer matches
+CREATE TABLE IF NOT EXISTS layout (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _layout(columns: List[str], schema: int) -> str:
+    return json.dumps({"db": DB_LAYOUT, "catalogue": schema, "columns": list(columns)})
+
+
+def catalogue_db_is_current(db_path: Path, columns: List[str], schema: int) -> bool:
+    """
+    Tell whether the database at *db_path* exists and was built with this
+    ``SCHEMA`` from catalogues of version *schema* with *columns*; ``CREATE ...
+    IF NOT EXISTS`` never migrates an older one, so it must be rebuilt instead.
+    """
+    if not Path(db_path).exists():
+        return False
+    try:
+        connection = sqlite3.connect(f"file:{Path(db_path).as_posix()}?mode=ro", uri=True)
+        try:
+            rows = connection.execute("SELECT value FROM layout WHERE key = 'layout'").fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        return False
+    return bool(rows) and rows[0][0] == _layout(columns, schema)
+
+
+def write_catalogue_db(frames: Dict[str, pd.DataFrame], db_path: Path, columns: List[str],
+                       removed: Iterable[str] = (), schema: int = 0) -> None:
+    """
+    Replace the rows of each catalogue in *frames* (and drop the *removed*
+    catalogues) in the SQLite database at *db_path*, creating it if needed.
+    Only *columns* are stored; columns a catalogue lacks are stored empty.
+    *schema* is the version of the catalogues, recorded for
+    ``catalogue_db_is_current``.
+    """
+    definitions = ",\n    ".join(
+        f"{_quote(column)} {'INTEGER' if column == 'Year' else 'TEXT'}" for column in columns
+    )
+    placeholders = ", ".join("?" * (len(columns) + 1))
+    insert = f"INSERT INTO catalogue (catalogue, {', '.join(map(_quote, columns))}) VALUES ({placeholders})"
+
+    connection = sqlite3.connect(db_path)
+    try:
+        with connection:
+            connection.executescript(SCHEMA.format(columns=definitions))
+            for name in [*removed, *frames]:
+                connection.execute("DELETE FROM catalogue WHERE catalogue = ?", (name,))
+            for name, df in frames.items():
+                df = df.reindex(columns=columns, fill_value="").astype(object)
+                df = df.where(df.notna(), None)
+                connection.executemany(insert, ([name, *row] for row in df.itertuples(index=False)))
+                rows = connection.execute("SELECT id, _norm_title FROM catalogue WHERE catalogue = ?", (name,))
+                connection.executemany(
+                    "INSERT INTO title_trigram (gram, id) VALUES (?, ?)",
+                    ((gram, row_id) for row_id, norm_title in rows.fetchall()
+                     for gram in title_trigrams(norm_title or "")),
+                )
+            connection.execute("INSERT OR REPLACE INTO layout (key, value) VALUES ('layout', ?)",
+                               (_layout(columns, schema),))
+        connection.execute("INSERT INTO catalogue_fts (catalogue_fts) VALUES ('optimize')")
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class SQLiteCatalogue:
+    """Catalogue subset stored in SQLite, with the matching interface of ``CatalogueIndex``.
+
+    Rows are identified by their database id. Only the rows a query needs are
+    read: exact titles and year/catalogue filters use B-tree indexes, fuzzy
+    title matching scores a full-text shortlist instead of every row.
+
+    Parameters:
+    -----------
+    db_path : Path
+        Database written by ``write_catalogue_db``
+    catalogues : list of str
+        Catalogue (orchestra file) names to match against
+    start_year, end_year : int
+        Range of recording years to match against
+    """
+
+    # Rows taken from the full-text or trigram index before fuzzy scoring
+    SHORTLIST_SIZE = CatalogueIndex.SHORTLIST_SIZE
+
+    def __init__(self, db_path: Path, catalogues: List[str], start_year: int, end_year: int):
+        # Several GUI threads read the catalogue; sqlite3 serialises access itself
+        self.connection = sqlite3.connect(f"file:{Path(db_path).as_posix()}?mode=ro", uri=True,
+                                          check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.catalogues = list(catalogues)
+        self.start_year, self.end_year = start_year, end_year
+        # Same rows as helper_functions.subset_entries on the concatenated catalogues
+        self._where = (f"catalogue IN ({', '.join('?' * len(catalogues))}) "
+                       f"AND Year BETWEEN ? AND ?")
+        self._params = [*catalogues, start_year, end_year]
+        self._year_subsets: Dict[Tuple[int, int], "SQLiteCatalogue"] = {}
+
+    def _query(self, sql: str, params: Iterable = ()) -> List[sqlite3.Row]:
+        return self.connection.execute(sql, [*params]).fetchall()
+
+    def __len__(self) -> int:
+        return self._query(f"SELECT COUNT(*) FROM catalogue WHERE {self._where}", self._params)[0][0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def with_years(self, start_year: int, end_year: int) -> "SQLiteCatalogue":
+        """Return this subset narrowed to *start_year*..*end_year*, as ``CatalogueIndex.with_years``.
+
+        The narrowed subset shares this one's connection.
+        """
+        key = (max(start_year, self.start_year), min(end_year, self.end_year))
+        if key not in self._year_subsets:
+            subset = copy.copy(self)
+            subset.start_year, subset.end_year = key
+            subset._params = [*self.catalogues, *key]
+            subset._year_subsets = {}
+            self._year_subsets[key] = subset
+        return self._year_subsets[key]
+
+    def row(self, idx: int) -> pd.Series:
+        """Return the catalogue row with id *idx*."""
+        row = self._query("SELECT * FROM catalogue WHERE id = ?", [idx])[0]
+        return pd.Series(dict(row), name=idx).drop(["id", "catalogue"])
+
+    def row_key(self, idx: int) -> str:
+        """Return the stable key of the row with id *idx*."""
+        return catalogue_row_key(self.row(idx))
+
+    def row_for_key(self, key: str) -> Optional[int]:
+        """Return the id of the row with *key*, or None if it is not in this subset."""
+        parts = key.split("|")
+        if len(parts) < len(ROW_KEY_COLUMNS):
+            return None
+        # Titles may themselves contain the separator
+        orchestra, date, singer, title = parts[0], parts[1], parts[-1], "|".join(parts[2:-1])
+        rows = self._query(
+            f"SELECT id FROM catalogue WHERE {self._where} AND Orchestra = ? AND IFNULL(Date, '') = ? "
+            f"AND Title = ? AND Singer = ? ORDER BY id LIMIT 1",
+            [*self._params, orchestra, date, title, singer],
+        )
+        return rows[0]["id"] if rows else None
+
+    def exact_matches(self, norm_title: str) -> List[int]:
+        """Return ids of rows whose normalised title equals *norm_title*."""
+        rows = self._query(
+            f"SELECT id FROM catalogue WHERE {self._where} AND _norm_title = ? ORDER BY id",
+            [*self._params, norm_title],
+        )
+        return [row["id"] for row in rows]
+
+    def shortlist(self, query: str) -> List[Tuple[int, str]]:
+        """Return ``(id, normalised title)`` of the rows whose titles share the most words with *query*.
+
+        Each word also matches titles sharing its first four letters, which keeps
+        misspelt words in play. When no title shares a word, the titles sharing the
+        most trigrams with *query* are returned instead, as ``CatalogueIndex.shortlist``
+        does; at most ``SHORTLIST_SIZE`` rows either way.
+        """
+        terms = [f'"{word[:4]}"*' if len(word) > 4 else f'"{word}"' for word in re.findall(r"\w+", query)]
+        rows = []
+        if terms:
+            rows = self._query(
+                f"SELECT c.id, c._norm_title FROM catalogue_fts JOIN catalogue c ON c.id = catalogue_fts.rowid "
+                f"WHERE catalogue_fts MATCH ? AND {self._where} "
+                f"ORDER BY catalogue_fts.rank LIMIT ?",
+                [f"Title : ({' OR '.join(terms)})", *self._params, self.SHORTLIST_SIZE],
+            )
+        grams = sorted(title_trigrams(query))
+        if not rows and grams:
+            rows = self._query(
+                f"SELECT c.id, c._norm_title FROM title_trigram t JOIN catalogue c ON c.id = t.id "
+                f"WHERE t.gram IN ({', '.join('?' * len(grams))}) AND {self._where} "
+                f"GROUP BY c.id ORDER BY COUNT(*) DESC, c.id LIMIT ?",
+                [*grams, *self._params, self.SHORTLIST_SIZE],
+            )
+        # Keep catalogue order so score ties rank as they do in memory
+        return sorted((row["id"], row["_norm_title"]) for row in rows)
+
+    def fuzzy_candidates(self, query: str, limit: int = 10, threshold: int = 60) -> List[int]:
+        """Return ids of the *limit* best fuzzy title matches scoring at least *threshold*."""
+        shortlist = self.shortlist(query)
+        scored = process.extract(query, [title for _, title in shortlist],
+                                 scorer=fuzz.token_sort_ratio, limit=limit)
+        return [shortlist[pos][0] for _, score, pos in scored if score >= threshold]
+
+    def batch_candidates(
+            self,
+            queries: Iterable[str],
+            limit: int = 10,
+            threshold: int = 60) -> Dict[str, List[int]]:
+        """Rank candidate rows for many normalised titles, as ``CatalogueIndex.batch_candidates``."""
+        results: Dict[str, List[int]] = {}
+        for query in dict.fromkeys(queries):
+            exact = self.exact_matches(query)
+            results[query] = exact[:limit] if exact else self.fuzzy_candidates(query, limit, threshold)
+        return results
+
+    def rank_candidates(
+            self,
+            candidate_indices: List[int],
+            audio_metadata: Dict[str, str],
+            titles: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+        """Score candidates on title, year, orchestra and singer, as ``CatalogueIndex.rank_candidates``."""
+        if not candidate_indices:
+            return []
+        rows = self._query(
+            f"SELECT id, _norm_title, Year, Orchestra, Singer FROM catalogue "
+            f"WHERE id IN ({', '.join('?' * len(candidate_indices))})",
+            candidate_indices,
+        )
+        candidates = pd.DataFrame([dict(row) for row in rows]).set_index("id").loc[candidate_indices]
+        return CatalogueIndex(candidates).rank_candidates(candidate_indices, audio_metadata, titles)
@@ -0,0 +1,263 @@
+"""Lookup structures built once per catalogue subset and reused for every file in a run."""
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process  # type: ignore
+from helper_functions import strip_accents
+
+# Columns identifying a recording independently of its position in a catalogue subset
+ROW_KEY_COLUMNS = ["Orchestra", "Date", "Title", "Singer"]
+
+
+def catalogue_row_key(row: pd.Series) -> str:
+    """Return a stable, human-readable key for a catalogue row."""
+    values = [row.get(col, "") for col in ROW_KEY_COLUMNS]
+    return "|".join("" if pd.isna(value) else str(value) for value in values)
+
+
+def catalogue_row_keys(catalogue: pd.DataFrame) -> pd.Series:
+    """Vectorised ``catalogue_row_key`` over a whole catalogue."""
+    keys = catalogue[ROW_KEY_COLUMNS[0]].fillna("").astype(str)
+    for col in ROW_KEY_COLUMNS[1:]:
+        keys = keys + "|" + catalogue[col].fillna("").astype(str)
+    return keys
+
+# Relative weight of each field in the combined candidate score. Fields the file
+# has no tag for (no date, no artist) are left out and the rest renormalised.
+FIELD_WEIGHTS = {"title": 0.6, "year": 0.2, "orchestra": 0.1, "singer": 0.1}
+
+
+def year_from_tag(date: str) -> Optional[int]:
+    """Return the recording year found in a file's date tag, or None."""
+    match = re.search(r"(?<!\d)(1[89]\d{2}|20\d{2})(?!\d)", date or "")
+    return int(match.group(1)) if match else None
+
+
+def title_trigrams(norm_title: str) -> set:
+    """Return the set of word-padded character trigrams of a normalised title."""
+    grams = set()
+    for word in norm_title.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class CatalogueIndex:
+    """Wrap a catalogue subset together with the lookup tables used by the matcher.
+
+    Parameters:
+    -----------
+    catalogue : pd.DataFrame
+        Catalogue subset with a normalised ``_norm_title`` column
+        (see ``metadata_handler.load_catalogue``).
+    """
+
+    # Number of queries scored per cdist call, bounds the score matrix size
+    BATCH_SIZE = 256
+    # Catalogues larger than this are pruned with the trigram index before fuzzy
+    # scoring, keeping the SHORTLIST_SIZE rows that share the most trigrams with the query
+    PRUNE_MIN_ROWS = 5000
+    SHORTLIST_SIZE = 300
+
+    def __init__(self, catalogue: pd.DataFrame):
+        self.catalogue = catalogue
+        self.title_index = self._build_title_index(catalogue)
+        self.choices = catalogue["_norm_title"].tolist()
+        self._key_index: Optional[Dict[str, int]] = None
+        self.trigram_index = (
+            self._build_trigram_index(self.choices) if len(catalogue) > self.PRUNE_MIN_ROWS else None
+        )
+
+        # Per-row arrays for multi-field scoring; names are factorised so artist
+        # similarity is computed once per distinct orchestra/singer, not per row
+        self.years = pd.to_numeric(catalogue["Year"], errors="coerce").fillna(-1).to_numpy(dtype=np.int32)
+        self.orchestra_codes, self.orchestras = self._factorize_names(catalogue, "Orchestra")
+        self.singer_codes, self.singers = self._factorize_names(catalogue, "Singer")
+        self._artist_scores: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._year_subsets: Dict[Tuple[int, int], "CatalogueIndex"] = {}
+
+    def __len__(self) -> int:
+        return len(self.catalogue)
+
+    def with_years(self, start_year: int, end_year: int) -> "CatalogueIndex":
+        """Return the index of the rows recorded from *start_year* to *end_year*.
+
+        Row labels are kept, so candidates found in the subset can be ranked and
+        read through this index. Each range is built once and reused.
+        """
+        key = (start_year, end_year)
+        if key not in self._year_subsets:
+            in_range = (self.years >= start_year) & (self.years <= end_year)
+            self._year_subsets[key] = CatalogueIndex(self.catalogue[in_range])
+        return self._year_subsets[key]
+
+    def row(self, idx: int) -> pd.Series:
+        """Return the catalogue row with index label *idx*."""
+        return self.catalogue.loc[idx]
+
+    def row_key(self, idx: int) -> str:
+        """Return the stable key of the row with index label *idx*."""
+        return catalogue_row_key(self.row(idx))
+
+    def row_for_key(self, key: str) -> Optional[int]:
+        """Return the index label of the row with *key*, or None if it is not in this subset."""
+        if self._key_index is None:
+            keys = catalogue_row_keys(self.catalogue)
+            # First occurrence wins for duplicated recordings; published only once
+            # complete, as the prefetch thread may look keys up concurrently
+            key_index = {}
+            for idx, row_key in zip(self.catalogue.index, keys):
+                key_index.setdefault(row_key, idx)
+            self._key_index = key_index
+        return self._key_index.get(key)
+
+    @staticmethod
+    def _factorize_names(catalogue: pd.DataFrame, column: str) -> Tuple[np.ndarray, List[str]]:
+        if column not in catalogue:
+            return np.zeros(len(catalogue), dtype=np.intp), [""]
+        codes, uniques = pd.factorize(catalogue[column].fillna("").astype(str))
+        return codes, [strip_accents(name) for name in uniques]
+
+    @staticmethod
+    def _build_trigram_index(choices: List[str]) -> Dict[str, np.ndarray]:
+        """Map each title trigram to the positions of the rows containing it."""
+        postings: Dict[str, List[int]] = {}
+        for pos, norm_title in enumerate(choices):
+            for gram in title_trigrams(norm_title):
+                postings.setdefault(gram, []).append(pos)
+        return {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+
+    def shortlist(self, query: str) -> Optional[np.ndarray]:
+        """Return positions of the rows sharing the most trigrams with *query*.
+
+        Returns None when the catalogue is small enough to score every row.
+        """
+        if self.trigram_index is None:
+            return None
+        postings = [self.trigram_index[gram] for gram in title_trigrams(query) if gram in self.trigram_index]
+        if not postings:
+            return np.array([], dtype=np.int32)
+        counts = np.bincount(np.concatenate(postings), minlength=len(self.choices))
+        hits = np.flatnonzero(counts)
+        if len(hits) > self.SHORTLIST_SIZE:
+            hits = hits[np.argpartition(-counts[hits], self.SHORTLIST_SIZE)[:self.SHORTLIST_SIZE]]
+        # Keep catalogue order so score ties rank as they do without pruning
+        return np.sort(hits)
+
+    def fuzzy_candidates(self, query: str, limit: int = 10, threshold: int = 60) -> List[int]:
+        """Return index labels of the *limit* best fuzzy title matches scoring at least *threshold*."""
+        positions = self.shortlist(query)
+        if positions is None:
+            scored = process.extract(query, self.choices, scorer=fuzz.token_sort_ratio, limit=limit)
+            return [self.catalogue.index[pos] for _, score, pos in scored if score >= threshold]
+        choices = [self.choices[pos] for pos in positions]
+        scored = process.extract(query, choices, scorer=fuzz.token_sort_ratio, limit=limit)
+        return [self.catalogue.index[positions[i]] for _, score, i in scored if score >= threshold]
+
+    @staticmethod
+    def _build_title_index(catalogue: pd.DataFrame) -> Dict[str, List[int]]:
+        """Map each normalised title to the catalogue index labels that carry it."""
+        title_index: Dict[str, List[int]] = {}
+        for idx, norm_title in zip(catalogue.index, catalogue["_norm_title"]):
+            title_index.setdefault(norm_title, []).append(idx)
+        return title_index
+
+    def exact_matches(self, norm_title: str) -> List[int]:
+        """Return index labels of rows whose normalised title equals *norm_title*."""
+        return self.title_index.get(norm_title, [])
+
+
+    def batch_candidates(
+            self,
+            queries: Iterable[str],
+            limit: int = 10,
+            threshold: int = 60) -> Dict[str, List[int]]:
+        """Rank candidate rows for many normalised titles at once.
+
+        Exact title matches are looked up in the hash index; the remaining
+        queries are scored against every catalogue title in multithreaded
+        ``rapidfuzz.process.cdist`` calls. Returns a mapping from query to
+        index labels, with the same ranking as ``tag_updater.find_candidate_rows``.
+        """
+        results: Dict[str, List[int]] = {}
+        fuzzy_queries = []
+        for query in dict.fromkeys(queries):
+            exact = self.exact_matches(query)
+            if exact:
+                results[query] = exact[:limit]
+            else:
+                fuzzy_queries.append(query)
+
+        if not self.choices:
+            results.update({query: [] for query in fuzzy_queries})
+            return results
+        if self.trigram_index is not None:
+            # Each query only scores its own shortlist
+            for query in fuzzy_queries:
+                results[query] = self.fuzzy_candidates(query, limit=limit, threshold=threshold)
+            return results
+
+        labels = self.catalogue.index
+        for start in range(0, len(fuzzy_queries), self.BATCH_SIZE):
+            chunk = fuzzy_queries[start:start + self.BATCH_SIZE]
+            scores = process.cdist(chunk, self.choices, scorer=fuzz.token_sort_ratio, workers=-1)
+            for query, row in zip(chunk, scores):
+                # Stable sort keeps ties in catalogue order, as process.extract does
+                top = np.argsort(-row, kind="stable")[:limit]
+                results[query] = [labels[pos] for pos in top if row[pos] >= threshold]
+        return results
+
+    def _artist_field_scores(self, artist: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Return per-row orchestra and singer similarity to a file's artist tag."""
+        if artist not in self._artist_scores:
+            query = strip_accents(artist)
+            orchestra_scores = process.cdist([query], self.orchestras, scorer=fuzz.token_set_ratio)[0]
+            singer_scores = process.cdist([query], self.singers, scorer=fuzz.token_set_ratio)[0]
+            self._artist_scores[artist] = (
+                orchestra_scores[self.orchestra_codes],
+                singer_scores[self.singer_codes],
+            )
+        return self._artist_scores[artist]
+
+    def rank_candidates(
+            self,
+            candidate_indices: List[int],
+            audio_metadata: Dict[str, str],
+            titles: Optional[List[str]] = None) -> List[Tuple[int, float]]:
+        """Score candidates on title, year, orchestra and singer in one vectorised pass.
+
+        The year comes from the file's ``date`` tag and the orchestra and singer are
+        compared with its ``artist`` tag (``"Orchestra - Singer"`` once tagged by this tool).
+        *titles* override the file's title, e.g. with a manually typed query; the title
+        score is the best over all of them.
+        Returns ``(index label, score)`` pairs, best first, with scores between 0 and 100.
+        """
+        if not candidate_indices:
+            return []
+        positions = self.catalogue.index.get_indexer(candidate_indices)
+        if titles is None:
+            titles = [audio_metadata.get("title", "")]
+        queries = [strip_accents(title) for title in titles]
+
+        fields = {
+            "title": process.cdist(queries, [self.choices[pos] for pos in positions],
+                                   scorer=fuzz.token_sort_ratio).max(axis=0),
+        }
+        year = year_from_tag(audio_metadata.get("date", ""))
+        if year is not None:
+            year_gap = np.abs(self.years[positions] - year)
+            fields["year"] = np.select([year_gap == 0, year_gap == 1], [100.0, 50.0], 0.0)
+        artist = audio_metadata.get("artist", "")
+        if artist:
+            orchestra_scores, singer_scores = self._artist_field_scores(artist)
+            fields["orchestra"] = orchestra_scores[positions]
+            fields["singer"] = singer_scores[positions]
+
+        total_weight = sum(FIELD_WEIGHTS[name] for name in fields)
+        combined = sum(FIELD_WEIGHTS[name] * scores for name, scores in fields.items()) / total_weight
+        order = np.argsort(-combined, kind="stable")
+        return [(candidate_indices[pos], float(combined[pos])) for pos in order]
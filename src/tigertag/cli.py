@@ -0,0 +1,152 @@
+"""Command-line entry point running the tag updater without any prompts."""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Union
+
+# Modules import each other by plain name, as when launched from this folder
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import pandas as pd  # noqa: E402
+import config_handler  # noqa: E402
+import tag_updater  # noqa: E402
+import vdj_updater  # noqa: E402
+from catalogue_db import SQLiteCatalogue  # noqa: E402
+from helper_functions import parse_years_from_folder  # noqa: E402
+from metadata_handler import load_catalogues, subset_catalogue  # noqa: E402
+
+DEFAULT_FORMAT = "orchestra last - title - singer last - year"
+
+
+def select_catalogue(artists, start_year: int, end_year: int) -> Union[pd.DataFrame, SQLiteCatalogue]:
+    """Concatenate the catalogues of *artists* (all if empty) and keep the given years.
+
+    With the ``sqlite`` catalogue backend the subset stays on disk as a ``SQLiteCatalogue``.
+    """
+    metadata_dict = load_catalogues()
+    unknown = [artist for artist in artists if artist not in metadata_dict]
+    if unknown:
+        raise SystemExit(f"Unknown artist(s): {', '.join(unknown)}. "
+                         f"Available: {', '.join(sorted(metadata_dict))}")
+    selected = artists or list(metadata_dict)
+    return subset_catalogue(metadata_dict, selected, start_year, end_year)
+
+
+def update_vdj_links(filename_changes, folder) -> None:
+    """Point the Virtual DJ database at renamed files if database linking is enabled."""
+    if not (config_handler.is_link_database_enabled() and filename_changes):
+        return
+    vdj_path = config_handler.get_vdj_database_path()
+    if not vdj_path or not Path(vdj_path).exists():
+        print(f"\nWarning: Virtual DJ database file not found: {vdj_path}")
+        print("Skipping database update.\n")
+        return
+    updated_count, error = vdj_updater.update_vdj_database(vdj_path, filename_changes, folder)
+    if error:
+        print(f"Error: {error}")
+    else:
+        print(f"Successfully updated {updated_count} entries in Virtual DJ database.")
+
+
+def folder_catalogue(args):
+    """Return the catalogue subset to match ``args.folder`` against, for the years given or in its name."""
+    folder = Path(args.folder)
+    start_year, end_year = parse_years_from_folder(folder)
+    start_year = args.start_year or start_year or 1900
+    end_year = args.end_year or end_year or 2050
+    catalogue = select_catalogue(args.artists, start_year, end_year)
+    print(f"Matching {folder} against {len(catalogue)} catalogue rows ({start_year}-{end_year})")
+    return catalogue
+
+
+def run(args) -> None:
+    folder = Path(args.folder)
+    queue_path = Path(args.queue) if args.queue else folder / "tigertag_review.json"
+    catalogue = folder_catalogue(args)
+    filename_changes = tag_updater.update_tags_headless(folder, catalogue, queue_path, args.format,
+                                                        recursive=args.recursive, include=args.include,
+                                                        exclude=args.exclude)
+    update_vdj_links(filename_changes, folder)
+
+
+def apply_review(args) -> None:
+    catalogue = select_catalogue([], 0, 9999)
+    filename_changes = tag_updater.apply_review_queue(Path(args.queue), catalogue)
+    update_vdj_links(filename_changes, Path(args.queue).parent)
+
+
+def plan(args) -> None:
+    folder = Path(args.folder)
+    plan_path = Path(args.plan) if args.plan else folder / "tigertag_plan.json"
+    catalogue = folder_catalogue(args)
+    tag_updater.plan_tags(folder, catalogue, plan_path, args.format,
+                          recursive=args.recursive, include=args.include, exclude=args.exclude)
+
+
+def show_plan(args) -> None:
+    with open(args.plan, "r", encoding="utf-8") as f:
+        tag_updater.print_plan(json.load(f))
+
+
+def apply_plan(args) -> None:
+    filename_changes = tag_updater.apply_plan(Path(args.plan))
+    update_vdj_links(filename_changes, Path(args.plan).parent)
+
+
+def add_matching_arguments(parser) -> None:
+    """Add the arguments selecting the files to tag and the catalogue to match them against."""
+    parser.add_argument("folder", help="Folder of audio files to tag")
+    parser.add_argument("--artists", nargs="*", default=[],
+                        help="Orchestras to match against (default: all)")
+    parser.add_argument("--start-year", type=int,
+                        help="First recording year (default: parsed from the folder name)")
+    parser.add_argument("--end-year", type=int,
+                        help="Last recording year (default: parsed from the folder name)")
+    parser.add_argument("--format", default=DEFAULT_FORMAT, help="Filename format")
+    parser.add_argument("--recursive", action="store_true",
+                        help="Also tag the files of subfolders, each matched against the years "
+                             "its folder name gives")
+    parser.add_argument("--include", nargs="*", default=None,
+                        help="Only tag files matching these glob patterns")
+    parser.add_argument("--exclude", nargs="*", default=None,
+                        help="Skip files and folders matching these glob patterns")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="tigertag", description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Apply confident matches and queue the rest for review")
+    add_matching_arguments(run_parser)
+    run_parser.add_argument("--queue", help="Review queue file (default: <folder>/tigertag_review.json)")
+    run_parser.set_defaults(func=run)
+
+    plan_parser = subparsers.add_parser(
+        "plan", help="Write the renames and tag changes of the confident matches without touching any file")
+    add_matching_arguments(plan_parser)
+    plan_parser.add_argument("--plan", help="Plan file (default: <folder>/tigertag_plan.json)")
+    plan_parser.set_defaults(func=plan)
+
+    show_plan_parser = subparsers.add_parser(
+        "show-plan", help="Print the renames and tag changes of a plan for review")
+    show_plan_parser.add_argument("plan", help="Plan file written by 'plan'")
+    show_plan_parser.set_defaults(func=show_plan)
+
+    apply_plan_parser = subparsers.add_parser(
+        "apply-plan", help="Carry out a plan as one batch of renames and tag writes")
+    apply_plan_parser.add_argument("plan", help="Plan file written by 'plan'")
+    apply_plan_parser.set_defaults(func=apply_plan)
+
+    apply_parser = subparsers.add_parser(
+        "apply-review", help="Apply the choices filled into a review queue")
+    apply_parser.add_argument("queue", help="Review queue file written by 'run'")
+    apply_parser.set_defaults(func=apply_review)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
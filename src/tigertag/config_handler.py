@@ -1,15 +1,44 @@
 """Configuration handler for saving and loading application settings."""
 import json
+import os
+import sys
 from pathlib import Path
 from typing import Optional
 
 CONFIG_FILE = Path(__file__).parent / "tigertag_config.json"
+# Folder under the per-user data directory holding the match cache and run journals
+APP_DATA_NAME = "TigerTag"
+
+def get_app_data_dir() -> Path:
+    """Get (and create) the per-user data directory for files TigerTag keeps between runs.
+
+    Not the install folder: a one-file build unpacks into a temporary folder that
+    is thrown away on exit, and site-packages may not be writable.
+    """
+    if sys.platform == "win32":
+        base = Path(os.environ.get("APPDATA") or Path.home() / "AppData" / "Roaming")
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Application Support"
+    else:
+        base = Path(os.environ.get("XDG_DATA_HOME") or Path.home() / ".local" / "share")
+    path = base / APP_DATA_NAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
 
 def load_config() -> dict:
     """Load configuration from file, return default if file doesn't exist."""
     default_config = {
         "vdj_database_path": "",
-        "link_database": False
+        "link_database": False,
+        "match_cache": True,
+        "auto_accept_margin": 10,
+        "auto_accept_min_score": 85,
+        "memory_mapped_catalogue": True,
+        "catalogue_backend": "pandas",
+        "write_workers": 4,
+        "scan_subfolders": False,
+        "header_tag_reader": True,
+        "resume_interrupted_runs": True
     }
     
     if CONFIG_FILE.exists():
@@ -56,3 +85,53 @@ def set_link_database(enabled: bool) -> None:
     config["link_database"] = enabled
     save_config(config)
 
+def is_match_cache_enabled() -> bool:
+    """Check if chosen matches are cached between runs."""
+    config = load_config()
+    return config.get("match_cache", True)
+
+def get_auto_accept_margin() -> float:
+    """Get the score lead the best candidate needs over the runner-up to be used without asking."""
+    config = load_config()
+    return float(config.get("auto_accept_margin", 10))
+
+def get_auto_accept_min_score() -> float:
+    """Get the score the best candidate needs to be used without asking, unless its title is exact."""
+    config = load_config()
+    return float(config.get("auto_accept_min_score", 85))
+
+def is_memory_mapped_catalogue_enabled() -> bool:
+    """Check if the catalogue is read from the memory-mapped Arrow file when it exists."""
+    config = load_config()
+    return config.get("memory_mapped_catalogue", True)
+
+def get_catalogue_backend() -> str:
+    """Get where catalogue subsets are matched: "pandas" (in memory) or "sqlite" (on disk)."""
+    config = load_config()
+    return config.get("catalogue_backend", "pandas")
+
+def get_write_workers() -> int:
+    """Get the number of background threads renaming and tagging accepted files."""
+    config = load_config()
+    return max(1, int(config.get("write_workers", 4)))
+
+def is_scan_subfolders_enabled() -> bool:
+    """Check if the files of subfolders are tagged along with the selected folder."""
+    config = load_config()
+    return config.get("scan_subfolders", False)
+
+def set_scan_subfolders(enabled: bool) -> None:
+    """Set scanning of subfolders enabled/disabled."""
+    config = load_config()
+    config["scan_subfolders"] = enabled
+    save_config(config)
+
+def is_header_tag_reader_enabled() -> bool:
+    """Check if tags are read for matching without parsing embedded pictures."""
+    config = load_config()
+    return config.get("header_tag_reader", True)
+
+def is_resume_enabled() -> bool:
+    """Check if an interrupted run over a folder is resumed instead of started over."""
+    config = load_config()
+    return config.get("resume_interrupted_runs", True)
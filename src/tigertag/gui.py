@@ -1,12 +1,12 @@
-from metadata_handler import load_parquet_folder, csv_to_parquet
-from helper_functions import subset_entries, parse_years_from_folder
+from metadata_handler import load_catalogues, csv_to_parquet, subset_catalogue, subset_source
+from helper_functions import parse_years_from_folder
 import tag_updater
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext
 import threading
 import sys
 import pandas as pd
-from io import StringIO
+import queue
 from pathlib import Path
 import pygame
 import time
@@ -14,13 +14,57 @@ import os
 import config_handler
 import vdj_updater
 
+# Seconds a background writer waits for the player to let go of a file
+RELEASE_TIMEOUT = 5
+
+
 class ConsoleRedirect:
-    """Redirects stdout to the GUI console"""
+    """Redirects stdout to the GUI console.
+
+    Background writers and the prefetch thread print too, and Tk widgets may
+    only be touched from the main thread: each thread's output is queued a
+    whole line at a time, and the main loop inserts the queued lines.
+    """
+    # How often the main loop shows queued output
+    POLL_MS = 50
+
     def __init__(self, text_widget):
         self.text_widget = text_widget
-        self.buffer = StringIO()
-        
+        self.lines = queue.Queue()
+        self.partial = threading.local()  # Each thread's unfinished line
+        self.text_widget.after(self.POLL_MS, self.drain)
+
+    def reset(self):
+        """Start a new run: padding is added again below its first output."""
+        if hasattr(self, '_padding_added'):
+            del self._padding_added
+
     def write(self, string):
+        text = getattr(self.partial, 'text', '') + string
+        lines, newline, rest = text.rpartition('\n')
+        if newline:
+            self.lines.put(lines + newline)
+        self.partial.text = rest
+
+    def flush(self):
+        text = getattr(self.partial, 'text', '')
+        if text:
+            self.lines.put(text)
+            self.partial.text = ''
+
+    def drain(self):
+        """Show the queued output (main thread only), then check again shortly."""
+        chunks = []
+        while True:
+            try:
+                chunks.append(self.lines.get_nowait())
+            except queue.Empty:
+                break
+        if chunks:
+            self.show(''.join(chunks))
+        self.text_widget.after(self.POLL_MS, self.drain)
+
+    def show(self, string):
         # Insert text at the end
         self.text_widget.insert(tk.END, string)
         
@@ -37,11 +81,6 @@ class ConsoleRedirect:
             self.text_widget.yview_scroll(-3, 'units')
         except:
             pass
-            
-        self.text_widget.update_idletasks()
-        
-    def flush(self):
-        pass
 
 class MusicPlayer(tk.Frame):
     """A compact, modern music player widget - all controls on one line"""
@@ -54,6 +93,7 @@ class MusicPlayer(tk.Frame):
         
         # Player state
         self.current_file = None
+        self.released_file = None  # File unloaded so it could be renamed and written
         self.is_playing = False
         self.is_paused = False
         self.volume = 0.7  # Default volume (0.0 to 1.0)
@@ -259,8 +299,8 @@ class MusicPlayer(tk.Frame):
             pygame.mixer.music.set_volume(0.0)
             self.mute_overlay.place(relx=0.5, rely=0.5, anchor='center')
     
-    def unload_file(self):
-        """Unload the current file to release file handle"""
+    def unload_file(self, released=None):
+        """Unload the current file to release file handle, then set the *released* event if given"""
         try:
             if self.is_playing or self.is_paused:
                 pygame.mixer.music.stop()
@@ -278,6 +318,24 @@ class MusicPlayer(tk.Frame):
             gc.collect()
         except Exception as e:
             print(f"Error unloading file: {str(e)}")
+        finally:
+            # Writers waiting on the file proceed; a lock that somehow remains is
+            # retried by the writer itself
+            if released is not None:
+                released.set()
+    
+    def release_file(self, file_path, released=None):
+        """Unload *file_path* if it is the file currently loaded, then set the *released* event if given"""
+        if self.current_file is not None and Path(file_path) == self.current_file:
+            self.unload_file(released)
+            self.released_file = Path(file_path)
+        elif released is not None:
+            released.set()
+    
+    def reload_file(self, old_path, new_path):
+        """Load *new_path* if the player let go of *old_path* for it to be written and has not moved on"""
+        if self.current_file is None and self.released_file == Path(old_path):
+            self.load_file(str(new_path))
     
     def load_file(self, file_path):
         """Load an audio file for playback"""
@@ -286,6 +344,7 @@ class MusicPlayer(tk.Frame):
         
         # Unload current file first to release file handle
         self.unload_file()
+        self.released_file = None
         
         self.current_file = Path(file_path)
         # Truncate filename if too long
@@ -447,7 +506,7 @@ class MusicPlayer(tk.Frame):
 class ArtistSelectorDropdown(tk.Frame):
     """A modern dropdown widget for selecting multiple artists with checkboxes"""
     
-    def __init__(self, parent, artists, **kwargs):
+    def __init__(self, parent, artists, on_select=None, **kwargs):
         """
         Parameters:
         -----------
@@ -455,8 +514,11 @@ class ArtistSelectorDropdown(tk.Frame):
             Parent widget
         artists : list or dict
             List of artist names or dict of artist data
+        on_select : callable, optional
+            Called with an artist name whenever that artist gets selected
         """
         super().__init__(parent, **kwargs)
+        self.on_select = on_select
         
         # Extract artist names if dict is provided
         if isinstance(artists, dict):
@@ -592,16 +654,28 @@ class ArtistSelectorDropdown(tk.Frame):
                            selectcolor='white',
                            relief=tk.FLAT,
                            anchor='w',
-                           command=self.update_count)
+                           command=lambda a=artist: self._on_checkbox_change(a))
         cb.pack(side=tk.LEFT, padx=5, pady=2)
         
         # Make frame clickable too
-        frame.bind('<Button-1>', lambda e, v=var: self._toggle_checkbox(v))
+        frame.bind('<Button-1>', lambda e, a=artist: self._toggle_checkbox(a))
         
-    def _toggle_checkbox(self, var):
+    def _toggle_checkbox(self, artist):
         """Toggle checkbox value when frame is clicked"""
+        var = self.artist_vars[artist]
         var.set(not var.get())
+        self._on_checkbox_change(artist)
+        
+    def _on_checkbox_change(self, artist):
+        """Update the count and notify the owner when an artist gets selected"""
         self.update_count()
+        if self.artist_vars[artist].get():
+            self._notify_selected([artist])
+            
+    def _notify_selected(self, artists):
+        if self.on_select is not None:
+            for artist in artists:
+                self.on_select(artist)
         
     def _add_hover(self, button, normal_color, hover_color):
         """Add hover effect to button"""
@@ -629,6 +703,7 @@ class ArtistSelectorDropdown(tk.Frame):
         for var in self.artist_vars.values():
             var.set(True)
         self.update_count()
+        self._notify_selected(list(self.artist_vars))
         
     def deselect_all(self):
         """Deselect all artists"""
@@ -651,6 +726,7 @@ class ArtistSelectorDropdown(tk.Frame):
         for artist, var in self.artist_vars.items():
             var.set(artist in artist_list)
         self.update_count()
+        self._notify_selected([artist for artist in self.artist_vars if artist in artist_list])
 
 
 class ToolGUI:
@@ -667,6 +743,10 @@ class ToolGUI:
         self.input_var = tk.StringVar()
         self.waiting_for_input = False
         self.input_result = None
+        self.input_received = threading.Event()  # Set once the user submits an answer
+        
+        # Tag the files of subfolders too
+        self.scan_subfolders = tk.BooleanVar(value=config_handler.is_scan_subfolders_enabled())
         
         # Virtual DJ database linking
         self.link_database = tk.BooleanVar()
@@ -681,6 +761,7 @@ class ToolGUI:
         
         # Create GUI elements
         self.create_widgets()
+        self.console_redirect = ConsoleRedirect(self.console)
         
         # Handle window close
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -732,7 +813,13 @@ class ToolGUI:
         )
         format_dropdown.grid(row=0, column=3, sticky=tk.W)
 
-        # Update metadata button on separate row
+        # Subfolder toggle and update metadata button on separate row
+        ttk.Checkbutton(
+            folder_frame,
+            text="Include subfolders",
+            variable=self.scan_subfolders,
+            command=lambda: config_handler.set_scan_subfolders(self.scan_subfolders.get())
+        ).grid(row=1, column=0, pady=5, sticky=tk.W)
         ttk.Button(folder_frame, text="Update Metadata", command=self.update_metadata).grid(row=1, column=1, pady=5, sticky=tk.W)
         
         # Start year
@@ -745,7 +832,7 @@ class ToolGUI:
         
         # Artist selector (move to row 3)
         ttk.Label(main_frame, text="Artists:").grid(row=3, column=0, sticky=(tk.W, tk.N), pady=5)
-        self.artist_selector = ArtistSelectorDropdown(main_frame, self.artists)
+        self.artist_selector = ArtistSelectorDropdown(main_frame, self.artists, on_select=self.preload_artist)
         self.artist_selector.grid(row=3, column=1, sticky=(tk.W, tk.E), pady=5)
         
         # Virtual DJ Database Linking (row 4)
@@ -857,6 +944,18 @@ class ToolGUI:
             self.vdj_database_path.set(file_path)
             config_handler.set_vdj_database_path(file_path)
     
+    def preload_artist(self, artist):
+        """Read an orchestra's catalogue in the background as soon as it is selected.
+
+        Only when the subset will be built from the per-orchestra frames; the other
+        sources never touch them.
+        """
+        metadata_dict = self.metadata_dict
+        if subset_source(metadata_dict) != "frames":
+            return
+        if hasattr(metadata_dict, "is_loaded") and not metadata_dict.is_loaded(artist):
+            threading.Thread(target=lambda: metadata_dict[artist], daemon=True).start()
+    
     def update_metadata(self):
         print("Updating Metadata")
         csv_to_parquet()
@@ -879,24 +978,30 @@ class ToolGUI:
             self.input_var.set("")
             self.input_frame.grid_remove()
             self.waiting_for_input = False
+            self.input_received.set()
             
     def custom_input(self, prompt=""):
         """Custom input function that works with the GUI"""
         if prompt:
-            self.console.insert(tk.END, prompt)
-            self.console.see(tk.END)
+            # Through the queue, so the prompt shows after the output printed before it
+            self.console_redirect.write(prompt)
+            self.console_redirect.flush()
             
-        self.waiting_for_input = True
         self.input_result = None
-        self.input_frame.grid()
-        self.input_entry.focus()
+        self.input_received.clear()
+        self.root.after(0, self.show_input)
         
-        # Wait for input
-        while self.waiting_for_input:
-            self.root.update()
+        # Wait for input; the main loop keeps running the window meanwhile
+        self.input_received.wait()
             
         return self.input_result
     
+    def show_input(self):
+        """Show the input area and wait for an answer (main thread only)"""
+        self.waiting_for_input = True
+        self.input_frame.grid()
+        self.input_entry.focus()
+    
     def run_tag_updater(self):
         # Validate inputs
         folder = self.folder_path.get()
@@ -921,6 +1026,7 @@ class ToolGUI:
         self.console.delete(1.0, tk.END)
         self.console.insert(tk.END, '\n' * 5)  # Add padding at the end
         self.console.mark_set('padding_start', 'end-6l')  # Mark where padding starts
+        self.console_redirect.reset()
         
         # Disable run button
         self.run_button.config(state='disabled')
@@ -937,127 +1043,79 @@ class ToolGUI:
         
         try:
             # Create metadata subset
-            metadata_sub = subset_entries(
-                df = pd.concat([metadata_dict[artist] for artist in selected_artists]),
+            metadata_sub = subset_catalogue(
+                metadata_dict,
+                selected_artists,
                 start_year = start_year,
                 end_year=end_year,
             )
             
             # Redirect after creating the data
-            sys.stdout = ConsoleRedirect(self.console)
+            sys.stdout = self.console_redirect
             __builtins__.input = self.custom_input
             
-            # Create a wrapper for update_tags that notifies about current file
-            def update_tags_with_player(audio_folder, catalogue):
-                """Wrapper that updates the player with current file"""
-                filename_changes = []
-                
-                for file in os.listdir(audio_folder):
-                    if not file.endswith(('.mp3', '.flac', '.m4a', '.mp4', "aif")):
-                        continue
-                    
-                    audio_file = Path(audio_folder, file)
-                    
-                    # Update player with current file
-                    self.root.after(0, lambda: self.music_player.load_file(str(audio_file)))
-                    self.current_audio_file = audio_file
-                    
-                    audio_metadata = tag_updater.get_audio_metadata(audio_file)
-                    chosen_idx = tag_updater.ask_choice(file, audio_metadata, catalogue)
-                    
-                    if chosen_idx != 9999:
-                        new_metadata = tag_updater.get_updated_metadata(catalogue.loc[chosen_idx].to_dict())
-                        try:
-                            old_filename = audio_file.name
-                            old_path_resolved = audio_file.resolve()
-                            
-                            # Unload file from player before any file operations
-                            self.root.after(0, lambda: self.music_player.unload_file())
-                            # Wait longer to ensure file is fully released
-                            import time
-                            time.sleep(0.3)  # Increased delay
-                            
-                            # First rename the file
-                            new_path = tag_updater.update_filename(
-                                audio_file, 
-                                new_metadata.title,
-                                new_metadata.orchestra,
-                                new_metadata.year,
-                                format_type=self.filename_format.get(),
-                                orchestra_last_name=new_metadata.orchestra_last_name,
-                                singer_last_name=new_metadata.singer_last_name,
-                                )
-                            new_filename = new_path.name
-                            new_path_resolved = new_path.resolve()
-                            
-                            if old_path_resolved != new_path_resolved:
-                                filename_changes.append((old_filename, new_filename))
-                            
-                            # Ensure file is not loaded in player before writing metadata
-                            self.root.after(0, lambda: self.music_player.unload_file())
-                            time.sleep(0.2)  # Additional delay before metadata write
-                            
-                            # Write metadata to the file
-                            try:
-                                tag_updater.write_metadata(new_path, new_metadata)
-                                print(f"Updated metadata for: {new_filename}")
-                            except PermissionError as pe:
-                                print(f"Permission denied writing metadata for {new_filename}: {str(pe)}")
-                                print("File may still be locked. Retrying after delay...")
-                                time.sleep(0.5)
-                                tag_updater.write_metadata(new_path, new_metadata)
-                                print(f"Successfully updated metadata for: {new_filename} on retry")
-                            except Exception as meta_error:
-                                print(f"Error updating metadata for {new_filename}: {str(meta_error)}")
-                                import traceback
-                                traceback.print_exc()
-                            
-                            # Update player with new path AFTER metadata is written
-                            if old_path_resolved != new_path_resolved:
-                                self.root.after(0, lambda p=new_path: self.music_player.load_file(str(p)))
-                            
-                        except Exception as e:
-                            print(f"Error processing {file}: {str(e)}")
-                            import traceback
-                            traceback.print_exc()
-                            continue
-                
-                tag_updater.print_filename_changes_table(filename_changes)
-                
-                # Update Virtual DJ database if enabled
-                if self.link_database.get() and filename_changes:
-                    vdj_path = self.vdj_database_path.get()
-                    if vdj_path and Path(vdj_path).exists():
-                        print("\n" + "=" * 80)
-                        print("Updating Virtual DJ Database...")
-                        print("=" * 80)
-                        updated_count, error = vdj_updater.update_vdj_database(
-                            vdj_path,
-                            filename_changes,
-                            folder
-                        )
-                        if error:
-                            print(f"Error: {error}")
-                        else:
-                            print(f"Successfully updated {updated_count} entries in Virtual DJ database.")
-                        print("=" * 80 + "\n")
-                    elif vdj_path:
-                        print(f"\nWarning: Virtual DJ database file not found: {vdj_path}")
-                        print("Skipping database update.\n")
-                
-                print("\n\n >>> Finished updating folder! <<< \n\n\n")
+            # Show each file in the player while it is being decided
+            def choose_with_player(file, audio_metadata, catalogue, **kwargs):
+                audio_file = Path(folder, file)
+                self.root.after(0, lambda: self.music_player.load_file(str(audio_file)))
+                self.current_audio_file = audio_file
+                return tag_updater.ask_choice(file, audio_metadata, catalogue, **kwargs)
+            
+            # Let go of a file only if the player still holds it; by the time a
+            # background writer gets to it the player may be on the next file.
+            # The writer waits until the Tk thread confirms the file is released.
+            def release_file(path):
+                released = threading.Event()
+                self.root.after(0, lambda: self.music_player.release_file(path, released))
+                if not released.wait(RELEASE_TIMEOUT):
+                    print(f"Player did not confirm releasing {path.name}; continuing")
+            
+            # Once written, a file the player let go of is loaded again under its new name
+            def reload_file(old_path, new_path):
+                self.root.after(0, lambda: self.music_player.reload_file(old_path, new_path))
             
-            # Run the tag updater with player integration
-            update_tags_with_player(folder, metadata_sub)
+            # Update Virtual DJ database if enabled; renames made before an interruption are linked too
+            def update_vdj(filename_changes):
+                if not (self.link_database.get() and filename_changes):
+                    return
+                vdj_path = self.vdj_database_path.get()
+                if vdj_path and Path(vdj_path).exists():
+                    print("\n" + "=" * 80)
+                    print("Updating Virtual DJ Database...")
+                    print("=" * 80)
+                    updated_count, error = vdj_updater.update_vdj_database(
+                        vdj_path,
+                        filename_changes,
+                        folder
+                    )
+                    if error:
+                        print(f"Error: {error}")
+                    else:
+                        print(f"Successfully updated {updated_count} entries in Virtual DJ database.")
+                    print("=" * 80 + "\n")
+                elif vdj_path:
+                    print(f"\nWarning: Virtual DJ database file not found: {vdj_path}")
+                    print("Skipping database update.\n")
+            
+            # Run the tag updater with player integration. Files are streamed: matching
+            # starts while the rest of the library is still being listed, and a run that
+            # was interrupted (crash, closed window) continues where it stopped
+            files = tag_updater.scan_audio_files(folder, recursive=self.scan_subfolders.get(),
+                                                 report_skipped=False)
+            tag_updater.run_tag_update(
+                folder, metadata_sub, self.filename_format.get(), files=files,
+                resume=config_handler.is_resume_enabled(), choose=choose_with_player,
+                release_file=release_file, after_write=reload_file, after_writes=update_vdj,
+            )
         
         except Exception as e:
-            if sys.stdout != ConsoleRedirect(self.console):
-                sys.stdout = ConsoleRedirect(self.console)
+            sys.stdout = self.console_redirect
             print(f"\nError: {str(e)}")
             import traceback
             traceback.print_exc()
             
         finally:
+            self.console_redirect.flush()
             sys.stdout = old_stdout
             __builtins__.input = old_input
             try:
@@ -1067,7 +1125,7 @@ class ToolGUI:
 
 if __name__ == "__main__":
     root = tk.Tk()
-    metadata_dict = load_parquet_folder()
+    metadata_dict = load_catalogues()
     artists = metadata_dict.keys()
     app = ToolGUI(root, artists=artists, metadata_dict=metadata_dict)
     root.mainloop()
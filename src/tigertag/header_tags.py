@@ -0,0 +1,186 @@
+"""Header-only tag reading: the text tags used for matching, without parsing embedded pictures.
+
+Full ``mutagen`` parses read every metadata block of a file, cover art included.
+The readers here walk block, frame and atom headers, skip picture payloads, and
+hand only the text tags to mutagen's own parsers, so the tags they return are
+the ones a full parse gives. Layouts they do not handle return None and the
+caller falls back to a full parse.
+"""
+from __future__ import annotations
+
+import io
+import os
+import re
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from mutagen.aiff import AIFFFile
+from mutagen.flac import VCFLACDict
+from mutagen.id3 import ID3
+from mutagen.mp4 import MP4Tags
+
+try:
+    # Private mutagen API; without it MP4 files get the full parse
+    from mutagen.mp4._atom import Atoms
+except ImportError:
+    Atoms = None
+
+# Frames behind the fields read for matching; TYER, TDAT and TIME are what
+# ID3v2.3 tags keep the recording date in until mutagen turns them into TDRC
+ID3_FRAMES = {b"TIT2", b"TPE1", b"TALB", b"TRCK", b"TCON", b"TDRC", b"TYER", b"TDAT", b"TIME"}
+# ilst items behind the fields read for matching (gnre is an ID3 genre number)
+MP4_ATOMS = {b"\xa9nam", b"\xa9ART", b"\xa9alb", b"\xa9gen", b"\xa9day", b"trkn", b"gnre"}
+FLAC_VORBIS_COMMENT = 4
+# Bytes at the end of a file mutagen checks for an ID3v1 tag
+ID3V1_TAIL = 131
+
+_FRAME_ID = re.compile(rb"[A-Z0-9]{4}")
+
+
+class _Unsupported(Exception):
+    """The file's tag layout is not handled here; it needs a full parse."""
+
+
+def _syncsafe(data: bytes) -> int:
+    value = 0
+    for byte in data:
+        if byte & 0x80:
+            raise _Unsupported("size not synchsafe")
+        value = (value << 7) | byte
+    return value
+
+
+def _to_syncsafe(value: int) -> bytes:
+    return bytes((value >> shift) & 0x7F for shift in (21, 14, 7, 0))
+
+
+def _read_id3(fileobj, offset: int) -> Optional[ID3]:
+    """Parse the ID3v2 tag at *offset*, reading only the frames in ``ID3_FRAMES``.
+
+    The kept frames are reassembled into a small tag followed by the file's last
+    bytes, and loaded with ``mutagen.id3.ID3`` as the full file would be (frame
+    upgrades to v2.4 and ID3v1 merging included). Returns None if there is no
+    ID3v2 header at *offset*.
+    """
+    fileobj.seek(offset)
+    header = fileobj.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return None
+    version, flags = header[3], header[5]
+    # Whole-tag unsynchronisation and extended headers are left to mutagen
+    if version not in (3, 4) or flags & 0xC0:
+        raise _Unsupported(f"ID3v2.{version} flags {flags:#x}")
+    end = offset + 10 + _syncsafe(header[6:10])
+
+    frames = []
+    position = offset + 10
+    while position + 10 <= end:
+        fileobj.seek(position)
+        frame_header = fileobj.read(10)
+        name = frame_header[:4]
+        if name.strip(b"\x00") == b"":
+            break  # padding
+        if version == 4:
+            size = _syncsafe(frame_header[4:8])
+        else:
+            size = int.from_bytes(frame_header[4:8], "big")
+        if not _FRAME_ID.fullmatch(name) or position + 10 + size > end:
+            raise _Unsupported(f"unexpected frame {name!r}")
+        if name in ID3_FRAMES:
+            frames.append(frame_header + fileobj.read(size))
+        position += 10 + size
+
+    fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(max(0, fileobj.tell() - ID3V1_TAIL))
+    tail = fileobj.read()
+    body = b"".join(frames) + b"\x00" * 10
+    return ID3(io.BytesIO(header[:6] + _to_syncsafe(len(body)) + body + tail))
+
+
+def _read_flac(fileobj) -> Optional[VCFLACDict]:
+    """Return the Vorbis comment of a FLAC file, seeking past every other metadata block."""
+    start = 4
+    magic = fileobj.read(4)
+    if magic != b"fLaC":
+        # An ID3v2 tag some taggers put before the FLAC stream, as mutagen allows
+        if magic[:3] != b"ID3":
+            raise _Unsupported("not a FLAC file")
+        start = 14 + _syncsafe(fileobj.read(6)[2:])
+        fileobj.seek(start - 4)
+        if fileobj.read(4) != b"fLaC":
+            raise _Unsupported("not a FLAC file")
+    fileobj.seek(start)
+
+    tags = None
+    while True:
+        header = fileobj.read(4)
+        if len(header) < 4:
+            raise _Unsupported("truncated metadata")
+        code, last = header[0] & 0x7F, header[0] & 0x80
+        if code == FLAC_VORBIS_COMMENT:
+            if tags is not None:
+                raise _Unsupported("several Vorbis comments")
+            # Parsed from the stream like mutagen does, which tolerates wrong block sizes
+            tags = VCFLACDict(fileobj)
+        else:
+            fileobj.seek(int.from_bytes(header[1:], "big"), os.SEEK_CUR)
+        if last:
+            return tags
+
+
+def _read_mp4(fileobj) -> Optional[MP4Tags]:
+    """Return the MP4 tags of the ``MP4_ATOMS`` items, leaving cover art and the rest unread."""
+    if Atoms is None or not hasattr(MP4Tags, "_can_load"):
+        raise _Unsupported("mutagen's MP4 atom reader is not available")
+    atoms = Atoms(fileobj)  # atom headers only
+    if not MP4Tags._can_load(atoms):
+        return None
+    ilst = atoms.path(b"moov", b"udta", b"meta", b"ilst")[-1]
+    ilst.children = [atom for atom in ilst.children if atom.name in MP4_ATOMS]
+    return MP4Tags(atoms, fileobj)
+
+
+def _read_aiff(fileobj) -> Optional[ID3]:
+    """Return the ID3 tag of an AIFF file's ``ID3`` chunk."""
+    try:
+        chunk = AIFFFile(fileobj)["ID3"]
+    except KeyError:
+        return None
+    tags = _read_id3(fileobj, chunk.data_offset)
+    if tags is None:
+        raise _Unsupported("ID3 chunk without an ID3v2 header")
+    return tags
+
+
+def read_header_tags(path: Union[str, Path]) -> Optional[Tuple[str, object]]:
+    """
+    Read the text tags of *path* without parsing its pictures.
+
+    Parameters:
+    -----------
+    path : str or Path
+        MP3, FLAC, MP4/M4A or AIFF file
+
+    Returns:
+    --------
+    tuple : ``(format, tags)`` with the format names of ``tag_updater.TagSession``
+        and tags as its parsed ``audio.tags`` would hold them for the matching
+        fields (None if the file has no tags), or None if the file needs a full parse
+    """
+    suffix = Path(path).suffix.lower()
+    try:
+        with open(path, "rb") as fileobj:
+            if suffix == ".mp3":
+                tags = _read_id3(fileobj, 0)
+                # Files with only an ID3v1 tag are rare; mutagen reads those
+                return ("mp3", tags) if tags is not None else None
+            if suffix in (".m4a", ".mp4"):
+                return "mp4", _read_mp4(fileobj)
+            if suffix == ".flac":
+                return "flac", _read_flac(fileobj)
+            if suffix in (".aif", ".aiff", ".aifc"):
+                return "aiff", _read_aiff(fileobj)
+    except Exception:
+        # Anything unexpected is left to the full parse, which reports real errors
+        return None
+    return None
@@ -1,8 +1,11 @@
 import unicodedata
+from functools import lru_cache
 from pathlib import Path
 import re
 import pandas as pd
 from datetime import datetime
+from typing import List, Tuple
+from rename_planner import RenamePlanner
 def strip_accents(text: str) -> str:
     """Return *text* lower‑cased and stripped of diacritics (accents)."""
     nfkd_form = unicodedata.normalize("NFKD", text)
@@ -13,36 +16,130 @@ def update_filename(path: Path, title: str, orchestra: str = "", year: str = "",
                    format_type: str = "orchestra - title - year", 
                    orchestra_last_name: str = "", singer_last_name: str = "") -> Path:
     """Rename the file to a slugified version based on the selected format, preserving the extension."""
-    if not path.is_file():
-        raise ValueError(f"Path is not a file: {path}")
+    new_path = build_filename(path, title, orchestra, year, format_type=format_type,
+                              orchestra_last_name=orchestra_last_name, singer_last_name=singer_last_name)
+    return rename_file(path, new_path)
+
 
-    # Build tag title based on format
-    tag_title = (format_type
-    .replace("orchestra last", orchestra_last_name)
-    .replace("orchestra", orchestra)
-    .replace("singer last", singer_last_name)
-    .replace("title", title)
-    .replace("year", year)
+def build_filename(path: Path, title: str, orchestra: str = "", year: str = "",
+                   format_type: str = "orchestra - title - year",
+                   orchestra_last_name: str = "", singer_last_name: str = "") -> Path:
+    """Return the path ``update_filename`` would give *path*, before resolving name collisions."""
+    return compile_filename_template(format_type).path(
+        path, title=title, orchestra=orchestra, year=year,
+        orchestra_last_name=orchestra_last_name, singer_last_name=singer_last_name,
     )
 
-    safe_title = slugify_filename(tag_title)
 
-    new_path = path.with_name(f"{safe_title}{path.suffix.lower()}")
-    # No rename if filename is already correct (case-insensitive on Windows)
-    if new_path.resolve() != path.resolve():
-        counter = 1
-        while new_path.exists():
-            new_path = path.with_name(f"{safe_title} ({counter}){path.suffix.lower()}")
-            counter += 1
+# Placeholder words of a filename format and the field each stands for; a longer
+# word is listed before the word it starts with so it is matched first
+FILENAME_PLACEHOLDERS = {
+    "orchestra last": "orchestra_last_name",
+    "orchestra": "orchestra",
+    "singer last": "singer_last_name",
+    "title": "title",
+    "year": "year",
+}
+_PLACEHOLDER_RE = re.compile("|".join(re.escape(word) for word in FILENAME_PLACEHOLDERS))
 
-        path.rename(new_path)
-        print(f"Renamed `{path.stem}` →→→ `{new_path.name}`")
-    else:
-        print(f"Kept name `{new_path.name}`")
-        print("_"*80,"\n","_"*80, "\n"*5)
-    return new_path
+# Catalogue column holding each field, for naming catalogue rows in bulk
+FILENAME_COLUMNS = {
+    "orchestra_last_name": "OrchestraLastName",
+    "orchestra": "Orchestra",
+    "singer_last_name": "SingerLastName",
+    "title": "Title",
+    "year": "Year",
+}
+# Column each derived last-name column is computed from
+_LAST_NAME_SOURCES = {"OrchestraLastName": "Orchestra", "SingerLastName": "Singer"}
+
+
+class FilenameTemplate:
+    """
+    A filename format such as ``"orchestra last - title - year"``, parsed once.
+
+    The format is split into literal text and fields when the template is built,
+    and values are substituted in a single pass, so a value containing a
+    placeholder word (a title with "year" in it) is kept as it is.
+
+    Parameters:
+    -----------
+    format_type : str
+        Filename format made of the ``FILENAME_PLACEHOLDERS`` words and literal text
+    """
+
+    def __init__(self, format_type: str):
+        self.format_type = format_type
+        # (literal text before the field, field) pairs, then the text after the last field
+        self.parts: List[Tuple[str, str]] = []
+        position = 0
+        for match in _PLACEHOLDER_RE.finditer(format_type):
+            self.parts.append((format_type[position:match.start()], FILENAME_PLACEHOLDERS[match.group()]))
+            position = match.end()
+        self.tail = format_type[position:]
+
+    def stem(self, **values: str) -> str:
+        """Return the slugified filename, without extension, for the field *values*."""
+        text = "".join(literal + values.get(field, "") for literal, field in self.parts) + self.tail
+        return slugify_filename(text)
+
+    def path(self, path: Path, **values: str) -> Path:
+        """Return *path* renamed after the field *values*, with its extension lower-cased."""
+        return path.with_name(f"{self.stem(**values)}{path.suffix.lower()}")
+
+    def stems(self, catalogue: pd.DataFrame) -> pd.Series:
+        """
+        Return the slugified filename of every row of *catalogue* at once.
 
+        Values are read from the ``FILENAME_COLUMNS`` as ``tag_updater.get_updated_metadata``
+        reads them (missing values are empty); last names missing from a catalogue
+        built without the derived tag columns are computed once per distinct name.
 
+        Returns:
+        --------
+        pd.Series : filenames without extension, indexed like *catalogue*
+        """
+        def column(name: str) -> pd.Series:
+            if name not in catalogue and name in _LAST_NAME_SOURCES:
+                return map_unique(column(_LAST_NAME_SOURCES[name]), get_last_name)
+            if name not in catalogue:
+                return pd.Series("", index=catalogue.index, dtype=object)
+            values = catalogue[name]
+            return values.astype(object).where(values.notna(), "").astype(str)
+
+        text = pd.Series("", index=catalogue.index, dtype=object)
+        for literal, field in self.parts:
+            text = text + literal + column(FILENAME_COLUMNS[field])
+        return map_unique(text + self.tail, slugify_filename)
+
+
+def map_unique(column: pd.Series, func) -> pd.Series:
+    """Apply *func* once per distinct value of *column*."""
+    uniques = column.unique()
+    return column.map(dict(zip(uniques, map(func, uniques))))
+
+
+@lru_cache(maxsize=None)
+def compile_filename_template(format_type: str) -> FilenameTemplate:
+    """Return the ``FilenameTemplate`` of *format_type*, parsed once per format."""
+    return FilenameTemplate(format_type)
+
+
+def rename_file(path: Path, new_path: Path) -> Path:
+    """Rename *path* to *new_path*, numbering the name if it is taken; return the final path."""
+    if not path.is_file():
+        raise ValueError(f"Path is not a file: {path}")
+
+    # Collisions are resolved against one listing of the folder (case-insensitively
+    # where the filesystem is), see ``RenamePlanner``
+    return RenamePlanner().rename(path, new_path)
+
+
+
+
+# Path separators and other characters illegal in a filename on some OS
+_ILLEGAL_FILENAME_CHARS = re.compile(r'[\/\\\?\%\*\:\|"<>\.]')
+_FILENAME_SEPARATORS = re.compile(r"[_\s]+")
 
 
 def slugify_filename(text: str, fallback: str = "untitled") -> str:
@@ -58,10 +155,10 @@ def slugify_filename(text: str, fallback: str = "untitled") -> str:
     text = "".join([c for c in text if not unicodedata.combining(c)])
 
     # Replace path separators and other illegal chars with underscores
-    text = re.sub(r'[\/\\\?\%\*\:\|"<>\.]', "_", text)
+    text = _ILLEGAL_FILENAME_CHARS.sub("_", text)
 
     # Collapse consecutive underscores/spaces and trim
-    text = re.sub(r"[_\s]+", " ", text).strip()
+    text = _FILENAME_SEPARATORS.sub(" ", text).strip()
 
     # Very long titles make unwieldy filenames
     return text[:120] if len(text) > 120 else text
@@ -236,8 +333,156 @@ def parse_date(date_str):
     return None
 
 
+# Numeric dates as handled by parse_date: month/day first (M/D/YYYY, D-M-YYYY, ...)
+# or year first (YYYY-M-D, YYYY/M/D)
+_DAY_FIRST_DATE = r'^(?P<a>\d{1,2})(?P<sep1>[/-])(?P<b>\d{1,2})(?P<sep2>[/-])(?P<year>\d{4})$'
+_YEAR_FIRST_DATE = r'^(?P<year>\d{4})(?P<sep1>[/-])(?P<a>\d{1,2})(?P<sep2>[/-])(?P<b>\d{1,2})$'
+
+
+def _valid_dates(year: pd.Series, month: pd.Series, day: pd.Series) -> pd.Series:
+    """Vectorised check that year/month/day form a real calendar date."""
+    in_range = month.between(1, 12) & day.between(1, 31) & year.between(1678, 2261)
+    parsed = pd.to_datetime(
+        pd.DataFrame({
+            "year": year.where(in_range, 2000),
+            "month": month.where(in_range, 1),
+            "day": day.where(in_range, 1),
+        }),
+        errors="coerce",
+    )
+    return in_range & parsed.notna()
+
+
+def _format_dates(year: pd.Series, month: pd.Series, day: pd.Series) -> pd.Series:
+    return (year.astype(str).str.zfill(4) + "-" + month.astype(str).str.zfill(2)
+            + "-" + day.astype(str).str.zfill(2))
+
+
+def _parse_numeric_dates(values: pd.Series) -> pd.Series:
+    """
+    Parse the numeric date forms in *values* with array operations, giving
+    the same strings as ``parse_date``. Values in any other form are left
+    as NaN.
+    """
+    result = pd.Series(None, index=values.index, dtype=object)
+
+    def assign(formatted: pd.Series, mask: pd.Series) -> None:
+        result.loc[formatted.index[mask]] = formatted[mask]
+
+    parts = values.str.extract(_DAY_FIRST_DATE).dropna()
+    year, a, b = parts["year"].astype(int), parts["a"].astype(int), parts["b"].astype(int)
+    # "00" in the first or second position is kept as a zero month or day,
+    # whatever the separators
+    zero_month = parts["a"] == "00"
+    zero_day = ~zero_month & (parts["b"] == "00")
+    assign(_format_dates(year, a * 0, b), zero_month)
+    assign(_format_dates(year, a, b * 0), zero_day)
+    # Otherwise month first is tried before day first
+    pending = ~zero_month & ~zero_day & (parts["sep1"] == parts["sep2"])
+    month_first = pending & _valid_dates(year, a, b)
+    day_first = pending & ~month_first & _valid_dates(year, b, a)
+    assign(_format_dates(year, a, b), month_first)
+    assign(_format_dates(year, b, a), day_first)
+
+    parts = values.str.extract(_YEAR_FIRST_DATE).dropna()
+    year, a, b = parts["year"].astype(int), parts["a"].astype(int), parts["b"].astype(int)
+    # parse_date reads years starting with "00" differently; leave them to it
+    plain_year = ~parts["year"].str.startswith("00")
+    zero_month = plain_year & (parts["a"] == "00")
+    zero_day = plain_year & ~zero_month & (parts["b"] == "00")
+    valid = (plain_year & ~zero_month & ~zero_day
+             & (parts["sep1"] == parts["sep2"]) & _valid_dates(year, a, b))
+    assign(_format_dates(year, a, b), zero_month | zero_day | valid)
+
+    return result
+
+
+def parse_dates(dates: pd.Series) -> pd.Series:
+    """
+    Vectorised ``parse_date`` over a whole column.
+
+    Each distinct date string is parsed once. The numeric forms that make up
+    nearly all catalogue dates are handled with array operations and only
+    the remaining values go through ``parse_date`` one by one.
+
+    Parameters:
+    -----------
+    dates : pd.Series
+        Raw date strings, e.g. the ``Date`` column of a catalogue CSV
+
+    Returns:
+    --------
+    pd.Series : "YYYY-MM-DD" strings (zero month/day kept), None where unparseable
+    """
+    values = dates.where(dates.notna(), "").astype(str).str.strip()
+    uniques = pd.Series(values.unique())
+    uniques = uniques[uniques != ""]
+
+    parsed = _parse_numeric_dates(uniques)
+    leftovers = parsed.isna()
+    parsed[leftovers] = uniques[leftovers].map(parse_date)
+
+    lookup = dict(zip(uniques, parsed))
+    return pd.Series([lookup.get(value) for value in values], index=dates.index, name=dates.name)
+
+
+# Particles kept with a surname, e.g. "Juan D'Arienzo" -> "D'Arienzo", "Alfredo De Angelis" -> "De Angelis"
+LAST_NAME_PREFIXES = {"De", "Di", "Del", "Della", "Dell", "Da", "Dos"}
+
+
+def get_last_name(name: str) -> str:
+    """Return the last name of *name*, keeping a leading particle such as "De"."""
+    parts = name.strip().split()
+    if len(parts) == 0:
+        return ""
+    elif len(parts) == 1:
+        return parts[0]
+    last_name = parts[-1]
+    if parts[-2] in LAST_NAME_PREFIXES:
+        return f"{parts[-2]} {last_name}"
+    return last_name
+
+
+def count_instruments(musicians: str, default: str = "Violin") -> str:
+    """
+    Summarise a comma-separated list of musicians as instrument counts.
+
+    Players without an instrument in parentheses play *default*, e.g.
+    "A, B, C (Viola)" -> "2 Violins, Viola, ".
+    """
+    other_instruments = {}
+    default_count = 0
+    lineup = ""
+    for player in musicians.split(","):
+        # Check if player has instrument in parentheses
+        if "(" in player and ")" in player:
+            # Extract instrument name from parentheses
+            start = player.rfind("(")
+            end = player.rfind(")")
+            if start < end:
+                instrument = player[start+1:end].strip()
+                instrument = instrument.capitalize()
+                other_instruments[instrument] = other_instruments.get(instrument, 0) + 1
+        else:
+            default_count += 1
+    if default_count == 1:
+        lineup += f"{default}, "
+    elif default_count > 1:
+        lineup += f"{default_count} {default}s, "
+    for instrument, count in other_instruments.items():
+        if count > 1:
+            lineup += f"{count} {instrument}s, "
+        else:
+            lineup += f"{instrument}, "
+    return lineup
+
+
 def subset_entries(df: pd.DataFrame, start_year: int, end_year: int) -> pd.DataFrame:
-    return df[df["Year"].astype(int).between(start_year, end_year)].reset_index(drop=True)
+    # Year is a nullable integer (older builds: a string); rows without a
+    # parseable date have no year and never fall in the range
+    years = pd.to_numeric(df["Year"], errors="coerce")
+    in_range = years.between(start_year, end_year).fillna(False).astype(bool)
+    return df[in_range].reset_index(drop=True)
 
 
 def parse_years_from_folder(folder_path):
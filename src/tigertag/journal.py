@@ -0,0 +1,126 @@
+"""Append-only journal of a tagging run, replayed to resume the run after a crash."""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Union
+
+import config_handler
+
+# Folder of the per-user data directory holding one journal per tagged folder
+JOURNAL_DIR_NAME = "journals"
+
+
+@dataclass
+class JournalState:
+    """What an unfinished run had done when it stopped."""
+    # Current path of each decided file -> chosen row key (None when the file was skipped)
+    decisions: Dict[str, Optional[str]] = field(default_factory=dict)
+    # Current paths of the files whose tags were written
+    done: Set[str] = field(default_factory=set)
+    # (old_path, new_path) of the renames already made
+    filename_changes: List[tuple] = field(default_factory=list)
+    # Files whose tags were already up to date
+    unchanged: List[str] = field(default_factory=list)
+
+
+class RunJournal:
+    """
+    JSON-lines journal of the decisions, renames and tag writes of one run over a folder.
+
+    Every event is flushed and synced to disk before ``record`` returns, so a run
+    killed at any point can be resumed from its journal. A run that finishes
+    deletes its journal. Safe to share between the deciding thread and
+    background writers.
+
+    Parameters:
+    -----------
+    path : str or Path
+        Journal file, normally the one ``for_folder`` keeps in the per-user data
+        directory for the folder being tagged
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def for_folder(cls, audio_folder) -> "RunJournal":
+        """The journal of runs over *audio_folder*, kept outside it so the music folder is left untouched."""
+        key = hashlib.sha1(os.path.normcase(os.path.abspath(audio_folder)).encode("utf-8")).hexdigest()
+        journal_dir = config_handler.get_app_data_dir() / JOURNAL_DIR_NAME
+        journal_dir.mkdir(exist_ok=True)
+        return cls(journal_dir / f"{key}.jsonl")
+
+    def load(self) -> Optional[JournalState]:
+        """Replay the journal; return the state of an unfinished run, or None if there is none."""
+        if not self.path.exists():
+            return None
+        state = JournalState()
+        finished = True
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # line cut short by the crash
+                event = entry.get("event")
+                if event == "start":
+                    state, finished = JournalState(), False
+                elif event == "finish":
+                    finished = True
+                elif event == "decided":
+                    state.decisions[entry["path"]] = entry.get("row_key")
+                elif event == "renamed":
+                    # The decision follows the file to its new name
+                    state.decisions[entry["new_path"]] = state.decisions.pop(entry["path"], None)
+                    if entry["path"] != entry["new_path"]:
+                        state.filename_changes.append((os.path.abspath(entry["path"]),
+                                                       os.path.abspath(entry["new_path"])))
+                elif event == "written":
+                    state.done.add(entry["path"])
+                    if entry.get("unchanged"):
+                        state.unchanged.append(Path(entry["path"]).name)
+        return None if finished else state
+
+    def start(self, resume: bool = False) -> None:
+        """Open the journal for appending; a new run (not *resume*) starts a new journal."""
+        try:
+            with self.lock:
+                self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        except OSError as e:
+            print(f"Could not open run journal {self.path}: {str(e)}. This run cannot be resumed.")
+            return
+        if not resume:
+            self.record("start")
+
+    def record(self, event: str, **fields) -> None:
+        """Append *event* with *fields* and make sure it reaches the disk."""
+        entry = {"event": event, "time": datetime.now().isoformat(timespec="seconds"), **fields}
+        with self.lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def finish(self) -> None:
+        """Mark the run as complete, close the journal and delete it: there is nothing left to resume."""
+        self.record("finish")
+        self.close()
+        try:
+            self.path.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"Could not delete run journal {self.path}: {str(e)}")
+
+    def close(self) -> None:
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
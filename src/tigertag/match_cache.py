@@ -0,0 +1,71 @@
+"""Persistent cache of the catalogue row chosen for each audio file."""
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import config_handler
+
+CACHE_FILE_NAME = "tigertag_cache.sqlite"
+
+
+def file_fingerprint(path: Union[str, Path], audio_metadata: Dict[str, str]) -> str:
+    """
+    Return a fingerprint of *path* built from its location, size, mtime and current tags.
+
+    Any change to the file (moved, rewritten or re-tagged by another tool) produces a
+    different fingerprint, so a stale cached choice is never reused.
+    """
+    path = Path(path)
+    stat = path.stat()
+    payload = json.dumps(
+        [str(path.resolve()), stat.st_size, stat.st_mtime_ns, sorted(audio_metadata.items())],
+        ensure_ascii=False,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class MatchCache:
+    """SQLite-backed mapping from file fingerprint to the chosen catalogue row key.
+
+    Safe to share between threads: background writers record matches while the
+    deciding thread looks them up.
+    """
+
+    def __init__(self, db_path: Union[str, Path, None] = None):
+        # Kept in the per-user data directory so it survives reinstalls and one-file builds
+        self.db_path = Path(db_path) if db_path is not None else config_handler.get_app_data_dir() / CACHE_FILE_NAME
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS matches ("
+            " fingerprint TEXT PRIMARY KEY,"
+            " row_key TEXT NOT NULL,"
+            " path TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        """Return the row key stored for *fingerprint*, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT row_key FROM matches WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, fingerprint: str, row_key: str, path: Union[str, Path]) -> None:
+        """Remember that the file with *fingerprint* was matched to *row_key*."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO matches (fingerprint, row_key, path) VALUES (?, ?, ?)",
+                (fingerprint, row_key, str(path)),
+            )
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
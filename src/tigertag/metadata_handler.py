@@ -1,7 +1,50 @@
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+from urllib.parse import quote
+import hashlib
+import json
 import os
+import shutil
+import threading
 import pandas as pd
-from helper_functions import strip_accents, parse_date
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import config_handler
+from catalogue_db import SQLiteCatalogue, catalogue_db_is_current, write_catalogue_db
+from helper_functions import strip_accents, parse_dates, subset_entries, get_last_name, count_instruments
+from helper_functions import map_unique
+
+# Root of the bundled catalogue; the launcher repoints it when running frozen
+METADATA_DIR = Path(Path(__file__).resolve().parent.parent.parent, "metadata")
+DATASET_DIR_NAME = "catalogue_dataset"
+# Records the state of each source CSV so unchanged ones are not rebuilt
+MANIFEST_NAME = "manifest.json"
+IPC_FILE_NAME = "catalogue.arrow"
+DB_FILE_NAME = "catalogue.sqlite"
+# Schema metadata key of the IPC file mapping each catalogue to its record batches
+IPC_LAYOUT_KEY = b"tigertag.catalogues"
+# Bumped whenever load_catalogue output changes, so existing builds are redone
+CATALOGUE_SCHEMA = 3
+
+# Tag fields derived from the catalogue columns at build time, as catalogue
+# column -> tag_updater.MetaData field
+TAG_COLUMNS = {
+    "Artist": "artist",
+    "OrchestraLastName": "orchestra_last_name",
+    "SingerLastName": "singer_last_name",
+    "Lineup": "lineup",
+    "Comment": "comment",
+}
+
+# Columns read back from the dataset: everything matching and tag writing uses
+CATALOGUE_COLUMNS = [
+    "Date", "Orchestra", "Title", "Genre", "Singer", "Label", "Master", "Composer", "Author",
+    "Pianist", "Bassist", "Bandoneons", "Strings", "Grouping", "_norm_title", "Year",
+    *TAG_COLUMNS,
+]
 
 
 def load_catalogue(csv_path: Path) -> pd.DataFrame:
@@ -10,38 +53,445 @@ def load_catalogue(csv_path: Path) -> pd.DataFrame:
     if "Title" not in df.columns:
         raise ValueError("CSV must contain a 'title' column")
     df["_norm_title"] = df["Title"].apply(strip_accents)
-    df["Date"] = df["Date"].apply(parse_date)
+    df["Date"] = parse_dates(df["Date"])
     df["Year"] = df['Date'].str.split('-').str[0]
+    add_tag_columns(df)
+
+    return compact_catalogue(df)
+
+
+# Low-cardinality columns (a few hundred distinct values at most) stored as categoricals
+CATEGORY_COLUMNS = [
+    "Orchestra", "Singer", "Genre", "Label", "Master", "Grouping", "Pianist", "Bassist",
+    "Artist", "OrchestraLastName", "SingerLastName", "Lineup",
+]
+# Free-text columns stored as Arrow-backed strings
+TEXT_COLUMNS = ["Note", "Composer", "Author", "Comment"]
 
+
+def compact_catalogue(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert a catalogue to its compact in-memory layout: categoricals for the
+    repetitive columns, Arrow strings for free text and a nullable Int16 year.
+    The layout survives the round trip through Parquet.
+    """
+    for column in CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("category")
+    for column in TEXT_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("string[pyarrow]")
+    df["Year"] = pd.to_numeric(df["Year"], errors="coerce").astype("Int16")
     return df
 
-def write_parquet_files(input_csv_folder, output_folder):
+
+def add_tag_columns(df: pd.DataFrame) -> None:
+    """
+    Add the ``TAG_COLUMNS`` derived from each row, matching what
+    ``tag_updater.MetaData`` would compute, so accepted matches become tag
+    payloads without per-row string work.
+    """
+    def column(name: str) -> pd.Series:
+        # Catalogue CSVs do not all share the same header; missing fields are empty tags
+        if name not in df:
+            return pd.Series("", index=df.index, dtype=object)
+        return df[name].fillna("")
+
+    orchestra, singer = column("Orchestra"), column("Singer")
+    df["Artist"] = orchestra + " - " + singer
+    df["OrchestraLastName"] = map_unique(orchestra, get_last_name)
+    df["SingerLastName"] = map_unique(singer, get_last_name)
+
+    lineup = (
+        map_unique(column("Bandoneons"), lambda players: count_instruments(players, "Bandoneon") if players else "")
+        + map_unique(column("Strings"), lambda players: count_instruments(players, "Violin") if players else "")
+        + column("Pianist").ne("").map({True: "Piano, ", False: ""})
+        + column("Bassist").ne("").map({True: "Bass", False: ""})
+    )
+    df["Lineup"] = lineup
+
+    comment = (
+        "Orchestra: " + orchestra + ", Singer: " + singer + "\n"
+        + "Date: " + column("Date") + ", Grouping: " + column("Grouping") + "\n"
+        + "Composer: " + column("Composer") + ", Author: " + column("Author") + "\n"
+        + "Lineup: " + lineup + "\n"
+        + "Label: " + column("Label") + ", Master: " + column("Master") + "\n"
+    )
+    for name in ["Pianist", "Bassist", "Bandoneons", "Strings"]:
+        values = column(name)
+        comment += (f"{name}: " + values + "\n").where(values != "", "")
+    df["Comment"] = comment
+
+
+def write_parquet_files(input_csv_folder, output_folder) -> Dict[str, pd.DataFrame]:
+    frames = {}
     for file in os.listdir(input_csv_folder):
         name = Path(file).stem
         print(name)
         df = load_catalogue(Path(input_csv_folder, file))
         df.to_parquet(Path(output_folder, name + ".parquet"))
+        frames[name] = df
+    return frames
 
 
-def load_parquet_folder():
+def write_catalogue_dataset(frames: Dict[str, pd.DataFrame], dataset_path: Path) -> None:
+    """
+    Write catalogues as one Parquet dataset, hive-partitioned by catalogue name
+    (the orchestra file name used as key everywhere else) and recording decade.
+    Partitions present in *frames* are replaced; others are left untouched.
+    """
+    tables = []
+    for name, df in frames.items():
+        decades = df["Year"] // 10 * 10
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.append_column("Catalogue", pa.array([name] * len(df), pa.string()))
+        table = table.append_column("Decade", pa.array(decades, pa.int16(), from_pandas=True))
+        tables.append(table)
+    ds.write_dataset(
+        pa.concat_tables(tables, promote_options="default"),
+        dataset_path,
+        format="parquet",
+        partitioning=["Catalogue", "Decade"],
+        partitioning_flavor="hive",
+        existing_data_behavior="delete_matching",
+    )
+
+
+def load_catalogue_subset(dataset_path: Path, catalogues: List[str], start_year: int,
+                          end_year: int, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Read the rows of *catalogues* recorded between *start_year* and *end_year* from
+    the partitioned dataset. Catalogue and decade filters prune whole partitions,
+    the year filter is pushed down into the Parquet reader, and only *columns*
+    (default ``CATALOGUE_COLUMNS``) are decoded.
     """
-    Load all Parquet files from a folder into a dictionary of DataFrames.
+    dataset = ds.dataset(dataset_path, format="parquet", partitioning="hive")
+    row_filter = (
+        ds.field("Catalogue").isin(catalogues)
+        & (ds.field("Decade") >= start_year // 10 * 10)
+        & (ds.field("Decade") <= end_year // 10 * 10)
+        & (ds.field("Year") >= start_year)
+        & (ds.field("Year") <= end_year)
+    )
+    table = dataset.to_table(columns=columns or CATALOGUE_COLUMNS, filter=row_filter)
+    return table.to_pandas().reset_index(drop=True)
+
+
+def subset_source(metadata_dict: Mapping) -> str:
+    """
+    Tell where ``subset_catalogue`` reads subsets from: "sqlite", "mapped",
+    "dataset" or, when none of those is available, "frames" (the per-orchestra
+    frames in *metadata_dict*).
+    """
+    if config_handler.get_catalogue_backend() == "sqlite" and \
+            catalogue_db_is_current(Path(METADATA_DIR, DB_FILE_NAME), CATALOGUE_COLUMNS, CATALOGUE_SCHEMA):
+        return "sqlite"
+    if isinstance(metadata_dict, MappedCatalogue):
+        return "mapped"
+    if Path(METADATA_DIR, DATASET_DIR_NAME).is_dir():
+        return "dataset"
+    return "frames"
+
+
+def subset_catalogue(metadata_dict: Mapping, catalogues: List[str], start_year: int,
+                     end_year: int) -> Union[pd.DataFrame, SQLiteCatalogue]:
+    """
+    Return the rows of *catalogues* recorded between *start_year* and *end_year*.
+
+    The first available source is used, in this order:
+
+    1. the SQLite database, with the "sqlite" catalogue backend: the subset is a
+       ``SQLiteCatalogue`` querying the database on disk instead of a DataFrame
+    2. the memory-mapped Arrow IPC file, when *metadata_dict* is a
+       ``MappedCatalogue`` (the "memory_mapped_catalogue" option)
+    3. the partitioned Parquet dataset
+    4. the per-orchestra frames in *metadata_dict*
+    """
+    source = subset_source(metadata_dict)
+    if source == "sqlite":
+        return SQLiteCatalogue(Path(METADATA_DIR, DB_FILE_NAME), catalogues, start_year, end_year)
+    if source == "mapped":
+        return metadata_dict.subset(catalogues, start_year, end_year)
+    if source == "dataset":
+        return load_catalogue_subset(Path(METADATA_DIR, DATASET_DIR_NAME), catalogues, start_year, end_year)
+    return subset_entries(
+        df=pd.concat([metadata_dict[catalogue] for catalogue in catalogues]),
+        start_year=start_year,
+        end_year=end_year,
+    )
+
+
+class LazyCatalogue(Mapping):
+    """
+    Read-only mapping of orchestra name to catalogue DataFrame that reads each
+    Parquet file the first time it is accessed and keeps it cached afterwards.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, paths: Dict[str, Path]):
+        self._paths = paths
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> pd.DataFrame:
+        with self._lock:
+            if key not in self._frames:
+                self._frames[key] = pd.read_parquet(self._paths[key])
+            return self._frames[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def is_loaded(self, key: str) -> bool:
+        return key in self._frames
+
+
+class MappedCatalogue(Mapping):
+    """
+    Read-only mapping of orchestra name to catalogue DataFrame backed by a
+    memory-mapped Arrow IPC file (see ``write_catalogue_ipc``). Opening it only
+    reads the file footer; a catalogue's pages are touched when it is first
+    accessed, and its columns are built zero-copy from the mapped buffers where
+    the dtype allows. Safe to use from several threads.
+    """
+
+    def __init__(self, path: Path):
+        self._reader = pa.ipc.open_file(pa.memory_map(str(path), "r"))
+        self._layout: Dict[str, List[int]] = json.loads(self._reader.schema.metadata[IPC_LAYOUT_KEY])
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> pd.DataFrame:
+        with self._lock:
+            if key not in self._frames:
+                first, count = self._layout[key]
+                batches = [self._reader.get_batch(i) for i in range(first, first + count)]
+                self._frames[key] = pa.Table.from_batches(batches, self._reader.schema).to_pandas()
+            return self._frames[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._layout)
+
+    def __len__(self) -> int:
+        return len(self._layout)
+
+    def is_loaded(self, key: str) -> bool:
+        return key in self._frames
+
+    def subset(self, catalogues: List[str], start_year: int, end_year: int) -> pd.DataFrame:
+        """
+        Read the rows of *catalogues* recorded between *start_year* and *end_year*
+        straight from the mapped record batches; only the selected rows are
+        converted to pandas.
+        """
+        with self._lock:
+            batches = [self._reader.get_batch(i)
+                       for catalogue in catalogues if catalogue in self._layout
+                       for i in range(self._layout[catalogue][0], sum(self._layout[catalogue]))]
+        table = pa.Table.from_batches(batches, self._reader.schema)
+        years = table.column("Year")
+        table = table.filter(pc.and_(pc.greater_equal(years, start_year), pc.less_equal(years, end_year)))
+        return table.to_pandas().reset_index(drop=True)
+
+
+def _ipc_schema() -> pa.Schema:
+    """Arrow schema shared by every catalogue in the IPC file."""
+    fields = []
+    for column in CATALOGUE_COLUMNS:
+        if column in CATEGORY_COLUMNS:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        elif column == "Year":
+            fields.append(pa.field(column, pa.int16()))
+        else:
+            fields.append(pa.field(column, pa.string()))
+    return pa.schema(fields)
+
+
+def write_catalogue_ipc(frames: Dict[str, pd.DataFrame], path: Path) -> None:
+    """
+    Write all catalogues to one uncompressed Arrow IPC file, so it can be
+    memory-mapped and read without decoding. Each catalogue is stored as its
+    own record batches (restricted to ``CATALOGUE_COLUMNS``), with one shared
+    dictionary per categorical column.
+    """
+    schema = _ipc_schema()
+    tables = []
+    for df in frames.values():
+        # Catalogue CSVs do not all share the same header
+        df = compact_catalogue(df.reindex(columns=CATALOGUE_COLUMNS, fill_value=""))
+        tables.append(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+    table = pa.concat_tables(tables).unify_dictionaries()
+
+    layout = {}
+    batches = []
+    offset = 0
+    for name, part in zip(frames, tables):
+        part_batches = table.slice(offset, part.num_rows).to_batches()
+        layout[name] = [len(batches), len(part_batches)]
+        batches.extend(part_batches)
+        offset += part.num_rows
+
+    schema = table.schema.with_metadata({**table.schema.metadata, IPC_LAYOUT_KEY: json.dumps(layout)})
+    tmp_path = path.with_suffix(".tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+    try:
+        os.replace(tmp_path, path)
+    except PermissionError:
+        # Windows refuses to replace a file that is still mapped by a running session
+        tmp_path.unlink(missing_ok=True)
+        print(f"{path.name} is in use; restart TigerTag and update the metadata again to refresh it")
+
+
+def load_catalogues(metadata_path: Optional[Path] = None) -> Mapping:
+    """
+    Index the catalogues without reading them: memory-maps the Arrow IPC file
+    when it has been built (and the option is enabled), otherwise indexes the
+    Parquet files.
+    """
+    ipc_path = Path(metadata_path or METADATA_DIR, IPC_FILE_NAME)
+    if config_handler.is_memory_mapped_catalogue_enabled() and ipc_path.exists():
+        return MappedCatalogue(ipc_path)
+    return load_parquet_folder(None if metadata_path is None else Path(metadata_path, "parquet_files"))
+
+
+def load_parquet_folder(metadata_path: Optional[Path] = None) -> LazyCatalogue:
+    """
+    Index the Parquet files of a folder without reading them.
     Returns:
     --------
-    dict : Dictionary with filenames (without extension) as keys and DataFrames as values
+    LazyCatalogue : Mapping with filenames (without extension) as keys; each DataFrame
+        is read on first access
     """
-    metadata_path = Path(Path(__file__).resolve().parent.parent.parent, "metadata", "parquet_files")
-    datasets = {}
-    
-    for parquet_file in metadata_path.glob('*.parquet'):
-        key = parquet_file.stem  # filename without .parquet extension
-        datasets[key] = pd.read_parquet(parquet_file)
+    if metadata_path is None:
+        metadata_path = Path(METADATA_DIR, "parquet_files")
     
-    return datasets
+    # filename without .parquet extension -> file
+    paths = {parquet_file.stem: parquet_file for parquet_file in sorted(metadata_path.glob('*.parquet'))}
+    return LazyCatalogue(paths)
+
+def file_sha256(path: Path) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _build_parquet(csv_path: Path, parquet_path: Path) -> pd.DataFrame:
+    """Parse one catalogue CSV and write its Parquet file (runs in a worker process)."""
+    df = load_catalogue(csv_path)
+    df.to_parquet(parquet_path)
+    return df
+
+
+def _remove_dataset_partition(dataset_path: Path, name: str) -> None:
+    # Partition directories are URI-encoded by the hive writer
+    shutil.rmtree(Path(dataset_path, f"Catalogue={quote(name, safe='')}"), ignore_errors=True)
+
+
+def csv_to_parquet(max_workers: Optional[int] = None):
+    """
+    Rebuild the Parquet catalogue from the CSV files, skipping unchanged ones.
+
+    A manifest next to the Parquet files records the size, mtime and SHA-256 of
+    each source CSV. A CSV is re-parsed only when its contents changed (a new
+    mtime with the same hash is just recorded); changed files are built in
+    parallel worker processes and only their dataset partitions are rewritten.
+    """
+    csv_folder = Path(METADATA_DIR, "csv_files")
+    parquet_folder = Path(METADATA_DIR, "parquet_files")
+    dataset_path = Path(METADATA_DIR, DATASET_DIR_NAME)
+    manifest_path = Path(parquet_folder, MANIFEST_NAME)
+
+    manifest = {}
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    csv_files = {csv_file.stem: csv_file for csv_file in sorted(csv_folder.glob("*.csv"))}
+    changed = {}
+    for name, csv_file in csv_files.items():
+        stat = csv_file.stat()
+        entry = manifest.get(name)
+        parquet_file = Path(parquet_folder, name + ".parquet")
+        if not parquet_file.exists() or (entry and entry.get("schema") != CATALOGUE_SCHEMA):
+            entry = None
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            continue
+        digest = file_sha256(csv_file)
+        manifest[name] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest,
+                          "schema": CATALOGUE_SCHEMA}
+        if entry and entry["sha256"] == digest:
+            continue
+        changed[name] = csv_file
+
+    # Catalogues whose CSV was deleted
+    removed = [name for name in manifest if name not in csv_files]
+    for name in removed:
+        print(f"Removing {name}")
+        del manifest[name]
+        Path(parquet_folder, name + ".parquet").unlink(missing_ok=True)
+        _remove_dataset_partition(dataset_path, name)
+
+    frames = {}
+    if changed:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                name: executor.submit(_build_parquet, csv_file, Path(parquet_folder, name + ".parquet"))
+                for name, csv_file in changed.items()
+            }
+            for name, future in futures.items():
+                frames[name] = future.result()
+                print(name)
+
+    # A missing dataset is built from every catalogue, changed or not
+    if not dataset_path.is_dir():
+        for name in csv_files:
+            if name not in frames:
+                frames[name] = pd.read_parquet(Path(parquet_folder, name + ".parquet"))
+    for name in frames:
+        _remove_dataset_partition(dataset_path, name)
+    if frames:
+        write_catalogue_dataset(frames, dataset_path)
+
+    # The database is updated per catalogue, or built from all of them when missing
+    # or built with other columns or tables
+    db_path = Path(METADATA_DIR, DB_FILE_NAME)
+    if not catalogue_db_is_current(db_path, CATALOGUE_COLUMNS, CATALOGUE_SCHEMA):
+        try:
+            db_path.unlink(missing_ok=True)
+        except PermissionError:
+            # Windows refuses to delete a database still open in a running session
+            print(f"{db_path.name} is in use; restart TigerTag and update the metadata again to rebuild it")
+        else:
+            write_catalogue_db(
+                {name: frames[name] if name in frames else pd.read_parquet(Path(parquet_folder, name + ".parquet"))
+                 for name in csv_files},
+                db_path, CATALOGUE_COLUMNS, schema=CATALOGUE_SCHEMA,
+            )
+    elif changed or removed:
+        write_catalogue_db({name: frames[name] for name in changed}, db_path, CATALOGUE_COLUMNS, removed,
+                           schema=CATALOGUE_SCHEMA)
+
+    # The memory-mapped file holds every catalogue, so any change rewrites it
+    ipc_path = Path(METADATA_DIR, IPC_FILE_NAME)
+    if changed or removed or not ipc_path.exists():
+        write_catalogue_ipc(
+            {name: frames[name] if name in frames else pd.read_parquet(Path(parquet_folder, name + ".parquet"))
+             for name in csv_files},
+            ipc_path,
+        )
 
-def csv_to_parquet():
-    metadata_folder = Path(Path(__file__).resolve().parent.parent.parent, "metadata")
-    write_parquet_files(Path(metadata_folder, "csv_files"), Path(metadata_folder, "parquet_files"))
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    print(f"Rebuilt {len(changed)} of {len(csv_files)} catalogue(s)")
 
 # input_path = "C:/Users/seric/OneDrive/Documents/Princeton Tango Club/DJing/tango_metadata"
 # output_path = "C:/Users/seric/OneDrive/Documents/GitHub/tigertag/metadata"
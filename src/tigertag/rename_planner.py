@@ -0,0 +1,285 @@
+"""Rename planning: target names and collisions resolved in memory from one listing per folder."""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Name a file in a rename cycle is moved to while the name it needs is freed
+CYCLE_TEMP_PREFIX = ".tigertag-rename-"
+
+
+class _Folder:
+    """The names in one folder, listed once and kept up to date as files are renamed."""
+
+    def __init__(self, path: Path):
+        names = os.listdir(path)
+        self.case_insensitive = _is_case_insensitive(path, names)
+        self.names = {self.key(name) for name in names}
+
+    def key(self, name: str) -> str:
+        return name.casefold() if self.case_insensitive else name
+
+    def taken(self, name: str) -> bool:
+        return self.key(name) in self.names
+
+    def free_name(self, target: Path) -> Path:
+        """Return *target*, numbered `` (1)``, `` (2)``... if its name is taken."""
+        stem = target.stem
+        counter = 1
+        while self.taken(target.name):
+            target = target.with_name(f"{stem} ({counter}){target.suffix}")
+            counter += 1
+        return target
+
+    def moved(self, old_name: Optional[str], new_name: Optional[str]) -> None:
+        if old_name is not None:
+            self.names.discard(self.key(old_name))
+        if new_name is not None:
+            self.names.add(self.key(new_name))
+
+
+def _is_case_insensitive(path: Path, names: List[str]) -> bool:
+    """Tell whether the filesystem of *path* ignores case, with at most one extra stat."""
+    listed = set(names)
+    for name in names:
+        swapped = name.swapcase()
+        if swapped != name:
+            # Both spellings listed: case matters; only one listed but both found: it does not
+            return swapped not in listed and os.path.exists(os.path.join(path, swapped))
+    # Nothing to probe with; go by the platform's default
+    return os.path.normcase("A") == "a" or sys.platform == "darwin"
+
+
+def _move_without_replacing(path: Path, target: Path) -> None:
+    """Move *path* to *target*, raising ``FileExistsError`` rather than replacing another file.
+
+    ``os.rename`` silently replaces an existing target on POSIX, so the file is
+    hard-linked to its new name (which fails if the name exists) and then unlinked.
+    Filesystems without hard links fall back to a checked rename.
+    """
+    try:
+        os.link(path, target)
+    except FileExistsError:
+        # The same file under another case on a case-insensitive filesystem: a recasing
+        if not os.path.samefile(path, target):
+            raise
+        path.rename(target)
+        return
+    except (OSError, NotImplementedError):
+        if target.exists() and not os.path.samefile(path, target):
+            raise FileExistsError(f"File exists: {target}")
+        path.rename(target)
+        return
+    try:
+        os.unlink(path)
+    except OSError:
+        os.unlink(target)  # still held (locked): undo, so the move can be retried
+        raise
+
+
+class RenamePlanner:
+    """
+    Resolve target filenames and their collisions in memory, then rename.
+
+    Each folder is listed once, the first time a file in it is renamed; the listing
+    is then updated with every rename, so no file is probed or resolved on disk to
+    find a free name. A file created after the listing is never overwritten: the
+    move itself refuses to replace a file and falls back to the next free name.
+    Names are compared case-insensitively where the filesystem ignores case. Safe
+    to share between threads: renames are serialised so two files never get the
+    same free name.
+
+    Files renamed one by one as they are decided use ``rename``. A batch known
+    in advance (a plan) is resolved by ``plan`` and carried out by ``execute``,
+    where names the batch itself frees are reused and chains and cycles of
+    renames (A→B while B→A) are ordered so no file is overwritten.
+
+    Parameters:
+    -----------
+    retry : callable, optional
+        Called with each rename operation and returns its result, for example to
+        retry renames of locked files (default: run the operation once)
+    """
+
+    def __init__(self, retry=None):
+        self.retry = retry or (lambda operation: operation())
+        self.lock = threading.Lock()
+        self._folders: Dict[Path, _Folder] = {}
+
+    def _folder(self, path: Path) -> _Folder:
+        folder = self._folders.get(path)
+        if folder is None:
+            folder = self._folders[path] = _Folder(path)
+        return folder
+
+    def _same_name(self, path: Path, target: Path) -> bool:
+        """Whether *target* names the file at *path* itself (possibly in another case)."""
+        return target.parent == path.parent and self._folder(path.parent).key(target.name) == \
+            self._folder(path.parent).key(path.name)
+
+    def _move(self, path: Path, target: Path) -> Path:
+        """Move *path* to *target* and return where it went.
+
+        A listing can be stale (files created since it was taken), so the move
+        never replaces a file: a target found taken is recorded in the listing
+        and the next free name is used instead.
+        """
+        while True:
+            try:
+                self.retry(lambda: _move_without_replacing(path, target))
+                break
+            except FileExistsError:
+                folder = self._folder(target.parent)
+                folder.moved(None, target.name)
+                target = folder.free_name(target)
+        self._folder(path.parent).moved(path.name, None)
+        self._folder(target.parent).moved(None, target.name)
+        return target
+
+    def rename(self, path: Path, target: Path) -> Path:
+        """Rename *path* to *target*, numbering the name if it is taken; return the final path."""
+        with self.lock:
+            if self._same_name(path, target):
+                if target.name == path.name:
+                    print(f"Kept name `{path.name}`")
+                    print("_"*80,"\n","_"*80, "\n"*5)
+                    return path
+            else:
+                target = self._folder(target.parent).free_name(target)
+            target = self._move(path, target)
+            print(f"Renamed `{path.stem}` →→→ `{target.name}`")
+            return target
+
+    def plan(self, moves: Iterable[Tuple[Path, Path]]) -> List[Tuple[Path, Path]]:
+        """
+        Resolve the final name of each ``(path, target)`` rename of a batch, without renaming.
+
+        Targets are numbered past the names of files outside the batch and past
+        earlier targets of the batch; names held by files the batch moves away
+        count as free.
+
+        Returns:
+        --------
+        list : ``(path, final_path)`` pairs in the order of *moves*
+        """
+        with self.lock:
+            moves = list(moves)
+            folders = {folder: self._folder(folder)
+                       for path, target in moves for folder in (path.parent, target.parent)}
+            # Planning changes nothing on disk: the listings are put back afterwards
+            listed = {path: set(folder.names) for path, folder in folders.items()}
+            try:
+                moving = [not self._same_name(path, target) for path, target in moves]
+                # Names the batch frees; files keeping their name (maybe recased) still hold theirs
+                for (path, target), is_moving in zip(moves, moving):
+                    if is_moving:
+                        folders[path.parent].moved(path.name, None)
+                for (path, target), is_moving in zip(moves, moving):
+                    if not is_moving:
+                        folders[target.parent].moved(None, target.name)
+                planned = []
+                for (path, target), is_moving in zip(moves, moving):
+                    if is_moving:
+                        target = folders[target.parent].free_name(target)
+                        folders[target.parent].moved(None, target.name)
+                    planned.append((path, target))
+                return planned
+            finally:
+                for path, names in listed.items():
+                    folders[path].names = names
+
+    def execute(self, planned: Iterable[Tuple[Path, Path]],
+                errors: List[tuple] | None = None) -> Dict[Path, Path]:
+        """
+        Carry out a batch of renames resolved by ``plan``.
+
+        A file is renamed once the file holding its target name has moved away;
+        files waiting on each other in a cycle are broken up by moving one of them
+        to a temporary name first. A target taken since the batch was planned is
+        numbered. Failed renames are reported and appended to *errors* as
+        ``(filename, message)``; a file waiting on a failed one gets a numbered name.
+
+        Returns:
+        --------
+        dict : the final path of every file of the batch that is in place, by original path
+        """
+        planned = list(planned)
+        final: Dict[Path, Path] = {}
+        with self.lock:
+            pending = {}  # (folder, key of current name) -> [original path, current path, target]
+            for path, target in planned:
+                if path == target:
+                    print(f"Kept name `{path.name}`")
+                    final[path] = path
+                else:
+                    pending[(path.parent, self._folder(path.parent).key(path.name))] = [path, path, target]
+
+            def holder(target: Path):
+                """The pending move whose file currently holds *target*'s name, if any."""
+                return pending.get((target.parent, self._folder(target.parent).key(target.name)))
+
+            waiting = {}  # source key of a pending move -> the move waiting for that name
+            ready = deque()
+            for source_key, move in pending.items():
+                blocking = holder(move[2])
+                if blocking is None or blocking is move:
+                    ready.append(source_key)
+                else:
+                    waiting[(blocking[1].parent, self._folder(blocking[1].parent).key(blocking[1].name))] = move
+
+            def release(source_key) -> None:
+                """The name at *source_key* is free (or will stay taken): wake the move waiting for it."""
+                move = waiting.pop(source_key, None)
+                if move is not None:
+                    ready.append((move[1].parent, self._folder(move[1].parent).key(move[1].name)))
+
+            while pending:
+                while ready:
+                    source_key = ready.popleft()
+                    original, current, target = pending.pop(source_key)
+                    try:
+                        if not self._same_name(current, target):
+                            target = self._folder(target.parent).free_name(target)
+                        target = self._move(current, target)
+                    except Exception as e:
+                        print(f"Error renaming {original.name}: {str(e)}")
+                        if errors is not None:
+                            errors.append((original.name, str(e)))
+                        if current != original:
+                            final[original] = current  # left under its cycle name
+                        release(source_key)
+                        continue
+                    print(f"Renamed `{original.stem}` →→→ `{target.name}`")
+                    final[original] = target
+                    release(source_key)
+
+                if pending:
+                    # Every remaining move waits on another; following the waits from any
+                    # of them ends in a cycle, broken by moving one file to a temporary name
+                    move, seen = next(iter(pending.values())), set()
+                    while id(move) not in seen:
+                        seen.add(id(move))
+                        move = holder(move[2])
+                    folder = self._folder(move[1].parent)
+                    source_key = (move[1].parent, folder.key(move[1].name))
+                    temp = folder.free_name(move[1].with_name(f"{CYCLE_TEMP_PREFIX}{move[1].name}"))
+                    try:
+                        temp = self._move(move[1], temp)
+                    except Exception as e:
+                        print(f"Error renaming {move[0].name}: {str(e)}")
+                        if errors is not None:
+                            errors.append((move[0].name, str(e)))
+                        del pending[source_key]
+                        release(source_key)
+                        continue
+                    print(f"Rename cycle: moved `{move[1].name}` aside to `{temp.name}`")
+                    # Still waiting, now under its temporary name
+                    del pending[source_key]
+                    move[1] = temp
+                    pending[(temp.parent, folder.key(temp.name))] = move
+                    release(source_key)
+        return final
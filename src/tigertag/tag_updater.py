@@ -1,17 +1,16 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import Dict, List
-from pathlib import Path
-from typing import Dict, Union
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 import pandas as pd
 from rapidfuzz import fuzz, process  # type: ignore
 from mutagen import File as MutagenFile
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 import os
 from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON, TDRC, TXXX  # noqa: E401
 from mutagen.id3 import TCOM, TPUB, TIT1, COMM, TENC, TPE3, TPE4
 from mutagen.flac import FLAC              
+from mutagen.mp3 import MP3
 from mutagen.mp4 import MP4, MP4FreeForm   
 from mutagen.aiff import AIFF
 from mutagen.easyid3 import EasyID3
@@ -20,11 +19,31 @@ EasyID3.RegisterTextKey("remixer", "TPE3")
 # EasyID3.RegisterTextKey("mixartist", "TPE4")
 
 import re
-from helper_functions import strip_accents, update_filename, parse_date
-from pathlib import Path
+import json
+import fnmatch
+import itertools
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from helper_functions import strip_accents, parse_date, get_last_name, count_instruments
+from helper_functions import build_filename, compile_filename_template
+from helper_functions import parse_years_from_folder
+from metadata_handler import TAG_COLUMNS
+from catalogue_index import CatalogueIndex
+from catalogue_db import SQLiteCatalogue
+from header_tags import read_header_tags
+from match_cache import MatchCache, file_fingerprint
+from journal import JournalState, RunJournal
+from rename_planner import RenamePlanner
+import config_handler
 
 EASYID3_CANONICAL = set(EasyID3.valid_keys.keys())
 
+# Returned by ask_choice when a file is skipped; never a row label of either catalogue backend
+SKIPPED = -1
+
 @dataclass
 class MetaData:
     title     : str
@@ -49,16 +68,17 @@ class MetaData:
     singer_last_name : str = None
     
     def __post_init__(self):
-        self.artist = f"{self.orchestra} - {self.singer}"
-        self.orchestra_last_name = self._get_last_name(self.orchestra)
-        self.singer_last_name = self._get_last_name(self.singer)
-        self.lineup = self._get_lineup()
-        comment = ""
-        for val in ["orchestra", "singer", "date", "label", "grouping", "master", "composer", "author", "pianist",
-                  "bassist", "bandoneons", "strings"]:
-            if getattr(self, val) != "":
-                comment += f"{val.capitalize()}: {getattr(self, val)}\n"
-        self.comment = self._build_comment()
+        # Derived fields are precomputed as catalogue columns; only fill in the missing ones
+        if self.artist is None:
+            self.artist = f"{self.orchestra} - {self.singer}"
+        if self.orchestra_last_name is None:
+            self.orchestra_last_name = get_last_name(self.orchestra)
+        if self.singer_last_name is None:
+            self.singer_last_name = get_last_name(self.singer)
+        if self.lineup is None:
+            self.lineup = self._get_lineup()
+        if self.comment is None:
+            self.comment = self._build_comment()
 
     def _build_comment(self):
         comment = f"Orchestra: {self.orchestra}, Singer: {self.singer}\n"
@@ -73,59 +93,20 @@ class MetaData:
     def _get_lineup(self):
         lineup = ""
         if self.bandoneons != "":
-            lineup += self._count_instruments(musicians = self.bandoneons, default = "Bandoneon")
+            lineup += count_instruments(musicians = self.bandoneons, default = "Bandoneon")
         if self.strings != "":
-            lineup += self._count_instruments(musicians = self.strings, default = "Violin")
+            lineup += count_instruments(musicians = self.strings, default = "Violin")
         if self.pianist != "": 
             lineup += f"Piano, "
         if self.bassist != "":
             lineup += f"Bass"
         return lineup
 
-    def _count_instruments(self, musicians: str, default:str = "Violin"):
-        other_instruments = {}
-        default_count = 0
-        lineup = ""
-        for player in musicians.split(","):
-            # Check if player has instrument in parentheses
-            if "(" in player and ")" in player:
-                # Extract instrument name from parentheses
-                start = player.rfind("(")
-                end = player.rfind(")")
-                if start < end:
-                    instrument = player[start+1:end].strip()
-                    instrument = instrument.capitalize()
-                    other_instruments[instrument] = other_instruments.get(instrument, 0) + 1
-            else:
-                default_count += 1
-        if default_count == 1:
-            lineup += f"{default}, "
-        elif default_count > 1:
-            lineup += f"{default_count} {default}s, "
-        for instrument, count in other_instruments.items():
-            if count > 1:
-                lineup += f"{count} {instrument}s, "
-            else:
-                lineup += f"{instrument}, "
-        return lineup
-    def _get_last_name(self, name: str):
-        prefixes = {"De", "Di", "Del", "Della", "Dell", "Da", "Dos"}
-        parts = name.strip().split()
-        if len(parts) == 0:
-            return ""
-        elif len(parts) == 1:
-            return parts[0]
-        last_name = parts[-1]
-        if len(parts) >= 2:
-            second_to_last = parts[-2]
-            if second_to_last in prefixes:
-                return f"{second_to_last} {last_name}"
-        
-        return last_name
-
 
 def get_updated_metadata(dct: dict):
-    dct = {k.lower(): v for k, v in dct.items()}
+    # Missing values (e.g. an unparseable date) are written as empty tags; the
+    # integer year and categorical fields are written as plain strings
+    dct = {k.lower(): ("" if pd.isna(v) else str(v)) for k, v in dct.items()}
     new_metadata = MetaData(
         title      = dct.get("title", ""),
         orchestra  = dct.get("orchestra", ""),
@@ -142,67 +123,320 @@ def get_updated_metadata(dct: dict):
         bassist    = dct.get("bassist", ""),
         bandoneons = dct.get("bandoneons", ""),
         strings    = dct.get("strings", ""),
+        # Precomputed by metadata_handler.add_tag_columns; None for catalogues built without them
+        **{field: dct.get(column.lower()) for column, field in TAG_COLUMNS.items()},
     )
     return new_metadata
 
-def get_audio_metadata(path: Union[str, Path]) -> Dict[str, str]:
-    """Extract a subset of metadata common across formats using *mutagen*."""
-    
-    # Convert to Path object if it's a string
-    path = Path(path) if isinstance(path, str) else path
-    
-    # Check if it's an AIFF file
-    if path.suffix.lower() in ['.aif', '.aiff', '.aifc']:
+# Attempts at an operation on a file another program (e.g. the player) still holds
+LOCK_RETRY_ATTEMPTS = 3
+LOCK_RETRY_DELAY = 0.2
+
+
+def retry_locked(operation, attempts: int = LOCK_RETRY_ATTEMPTS, delay: float = LOCK_RETRY_DELAY):
+    """Return ``operation()``, retrying with a growing delay while it raises ``PermissionError``.
+
+    Only a lock the OS actually reports costs any waiting; the last ``PermissionError``
+    is raised once *attempts* are used up.
+    """
+    for attempt in range(attempts):
         try:
-            audio = AIFF(path)
-            if audio.tags is None:
-                return {
-                    "title": "",
-                    "artist": "",
-                    "album": "",
-                    "tracknumber": "",
-                    "genre": "",
-                    "date": "",
-                }
-            
-            # AIFF uses ID3 tags
-            def get_id3_text(frame_id: str) -> str:
-                frame = audio.tags.get(frame_id)
-                return str(frame) if frame else ""
-            
-            # Extract track number (format: "1/12" or "1")
-            track = get_id3_text("TRCK")
-            track_num = track.split('/')[0] if track else ""
-            
+            return operation()
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay * (attempt + 1))
+
+
+class TagSession:
+    """An audio file's tags, parsed once for reading, updating and saving.
+
+    ``current`` holds the tags the file had when opened (the fields used for
+    matching and previews). ``apply`` sets the tags of a catalogue match on the
+    parsed tags and ``save`` writes them back in one go, so a file is opened
+    once per update rather than once per step.
+
+    Parameters:
+    -----------
+    path : str or Path
+        Audio file; MP3, FLAC, MP4/M4A and AIFF can be written, any other
+        format mutagen reads can only be read
+    """
+
+    # Attempts at saving a file another program (e.g. the player) still holds
+    SAVE_ATTEMPTS = LOCK_RETRY_ATTEMPTS
+    SAVE_RETRY_DELAY = LOCK_RETRY_DELAY
+    # Fields read under mutagen's "easy" key names, as get_audio_metadata always has
+    ID3_TEXT_FRAMES = {"title": "TIT2", "artist": "TPE1", "album": "TALB", "tracknumber": "TRCK"}
+    MP4_TEXT_ATOMS = {"title": "©nam", "artist": "©ART", "album": "©alb", "genre": "©gen", "date": "©day"}
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        suffix = self.path.suffix.lower()
+        if suffix == ".mp3":
+            self.format, self.audio = "mp3", MP3(self.path)
+        elif suffix in (".m4a", ".mp4"):
+            self.format, self.audio = "mp4", MP4(self.path)
+        elif suffix == ".flac":
+            self.format, self.audio = "flac", FLAC(self.path)
+        elif suffix in (".aif", ".aiff", ".aifc"):
+            try:
+                self.format, self.audio = "aiff", AIFF(self.path)
+            except Exception:
+                raise ValueError(f"Error reading AIFF file: {self.path}")
+        else:
+            self.format, self.audio = "other", MutagenFile(self.path, easy=True)
+            if self.audio is None:
+                raise ValueError(f"Unsupported or unreadable file: {self.path}")
+        self.current = self.read()
+
+    def read(self) -> Dict[str, str]:
+        """Return the common subset of the file's tags, as currently parsed."""
+        return self.read_tags(self.format, self.audio.tags)
+
+    @classmethod
+    def read_tags(cls, format: str, tags) -> Dict[str, str]:
+        """Return the common subset of parsed *tags* of a file in *format* (see ``read``)."""
+        if format == "aiff":
+            return cls._read_aiff(tags)
+        if tags is None:
+            keys = ["title", "artist", "album", "tracknumber", "genre", "label", "date"]
+            return {key: "" for key in keys}
+        if format in ("mp3", "mp4"):
+            reader = cls._first_mp3 if format == "mp3" else cls._first_mp4
+
+            def first(key: str) -> str:
+                return reader(tags, key)
+        else:
+            def first(key: str) -> str:
+                val = tags.get(key)
+                return val[0] if val else ""
+        return {
+            "title": first("title"),
+            "artist": first("artist"),
+            "album": first("album"),
+            "tracknumber": first("tracknumber"),
+            "genre": first("genre"),
+            "label": first("label"),
+            "date": first("date"),
+        }
+
+    @classmethod
+    def _first_mp3(cls, tags, key: str) -> str:
+        if key == "genre":
+            values = tags["TCON"].genres if "TCON" in tags else []
+        elif key == "date":
+            values = [stamp.text for stamp in tags["TDRC"].text] if "TDRC" in tags else []
+        elif key in cls.ID3_TEXT_FRAMES and cls.ID3_TEXT_FRAMES[key] in tags:
+            values = list(tags[cls.ID3_TEXT_FRAMES[key]].text)
+        else:
+            values = []
+        return values[0] if values else ""
+
+    @classmethod
+    def _first_mp4(cls, tags, key: str) -> str:
+        if key == "tracknumber":
+            if not tags.get("trkn"):
+                return ""
+            track, total = tags["trkn"][0]
+            return f"{track}/{total}" if total else str(track)
+        values = tags.get(cls.MP4_TEXT_ATOMS.get(key, ""))
+        return values[0] if values else ""
+
+    @staticmethod
+    def _read_aiff(tags) -> Dict[str, str]:
+        if tags is None:
             return {
-                "title": get_id3_text("TIT2"),
-                "artist": get_id3_text("TPE1"),
-                "album": get_id3_text("TALB"),
-                "tracknumber": track_num,
-                "genre": get_id3_text("TCON"),
-                "date": get_id3_text("TDRC"),
+                "title": "",
+                "artist": "",
+                "album": "",
+                "tracknumber": "",
+                "genre": "",
+                "date": "",
             }
-        except Exception:
-            raise ValueError(f"Error reading AIFF file: {path}")
-    
-    # Handle other formats with easy=True
-    audio = MutagenFile(path, easy=True)
-    if audio is None:
-        raise ValueError(f"Unsupported or unreadable file: {path}")
-    
-    def first(key: str) -> str:
-        val = audio.tags.get(key) if audio.tags else None
-        return val[0] if val else ""
-    
-    return {
-        "title": first("title"),
-        "artist": first("artist"),
-        "album": first("album"),
-        "tracknumber": first("tracknumber"),
-        "genre": first("genre"),
-        "label": first("label"),
-        "date": first("date"),
-    }
+
+        # AIFF uses ID3 tags
+        def get_id3_text(frame_id: str) -> str:
+            frame = tags.get(frame_id)
+            return str(frame) if frame else ""
+
+        # Extract track number (format: "1/12" or "1")
+        track = get_id3_text("TRCK")
+        track_num = track.split('/')[0] if track else ""
+
+        return {
+            "title": get_id3_text("TIT2"),
+            "artist": get_id3_text("TPE1"),
+            "album": get_id3_text("TALB"),
+            "tracknumber": track_num,
+            "genre": get_id3_text("TCON"),
+            "date": get_id3_text("TDRC"),
+        }
+
+    def _snapshot(self) -> Dict[str, str]:
+        """Return the parsed tags as they would read back after a save, leaving out pictures.
+
+        Key order and empty values are ignored: formats keep fields in the order
+        they were set, and mutagen does not write empty frames, so neither is a change.
+        """
+        tags = self.audio.tags
+        if tags is None:
+            return {}
+        if self.format == "flac":
+            # Vorbis comments are (field, value) pairs with case-insensitive field names;
+            # pictures are separate blocks
+            fields: Dict[str, List[str]] = {}
+            for key, value in tags:
+                if value:
+                    fields.setdefault(key.lower(), []).append(value)
+            return {key: "\n".join(values) for key, values in sorted(fields.items())}
+        if self.format == "mp4":
+            return {key: repr(value) for key, value in sorted(tags.items())
+                    if key != "covr" and any(item not in ("", b"") for item in value)}
+        # ID3 frames by content: MP3s are saved as ID3v2.3, which re-encodes
+        # UTF-8 text frames as UTF-16 without changing their values
+        snapshot = {}
+        for key, frame in sorted(tags.items()):
+            if key.startswith("APIC"):
+                continue
+            text = getattr(frame, "text", None)
+            value = "\n".join(str(item) for item in text) if text is not None else frame.pprint()
+            if value:
+                snapshot[key] = value
+        return snapshot
+
+    def apply(self, new_meta: MetaData) -> bool:
+        """Set the tags of *new_meta* on the parsed file, without saving.
+
+        Returns False if the file already had exactly these tags, so there is nothing to save.
+        """
+        if self.format == "other":
+            raise ValueError(f"Unsupported file for writing metadata: {self.path}")
+        before = self._snapshot()
+        if self.audio.tags is None:
+            self.audio.add_tags()
+        tags = self.audio.tags
+        if self.format == "mp3":
+            self._apply_mp3(tags, new_meta)
+        elif self.format == "mp4":
+            self._apply_mp4(tags, new_meta)
+        elif self.format == "flac":
+            self._apply_flac(tags, new_meta)
+        else:
+            self._apply_aiff(tags, new_meta)
+        return self._snapshot() != before
+
+    @staticmethod
+    def _apply_mp3(audio: ID3, new_meta: MetaData) -> None:
+        """Regular ID3 frames (all fields supported)."""
+        # Standard fields
+        audio.add(TIT2(encoding=3, text=new_meta.title))        # Title
+        audio.add(TPE1(encoding=3, text=new_meta.artist))       # Artist
+        audio.add(TCON(encoding=3, text=new_meta.genre))        # Genre
+        audio.add(TDRC(encoding=3, text=new_meta.year))         # Date/Year
+        audio.add(TCOM(encoding=3, text=new_meta.composer))     # Composer
+        # Get existing label/publisher
+        old_label = ""
+        if 'TPUB' in audio:
+            old_label = str(audio['TPUB'].text[0])
+        # Move old label to remixer field (TPE3), unless it is the label being written
+        # (an already tagged file keeps the original label it moved there)
+        if old_label and old_label != new_meta.label:
+            audio.add(TPE4(encoding=3, text=old_label))
+        audio.add(TIT1(encoding=3, text=new_meta.grouping))     # Grouping/Content Group
+        audio.add(TPUB(encoding=3, text=new_meta.label))
+        # Comment (requires special structure)
+        audio.add(COMM(encoding=3, lang='eng', desc='', text=new_meta.comment))
+
+    @staticmethod
+    def _apply_mp4(audio, new_meta: MetaData) -> None:
+        audio["©nam"] = [new_meta.title]
+        audio["©ART"] = [new_meta.artist]
+        audio["©gen"] = [new_meta.genre]
+        audio["©grp"] = [new_meta.grouping]
+        audio["©day"] = [new_meta.year]
+        audio["©cmt"] = [new_meta.comment]
+        audio["©wrt"] = [new_meta.composer]
+        # audio["©pub"] = [new_meta.label]
+        set_mp4_freeform(audio, "REMIXER", new_meta.pianist)
+        # set_mp4_freeform(audio, "Label", new_meta.label)
+
+    @staticmethod
+    def _apply_aiff(audio: ID3, new_meta: MetaData) -> None:
+        """Update AIFF metadata based on existing structure."""
+        # Direct dictionary-style assignment
+        audio['TIT2'] = TIT2(encoding=3, text=new_meta.title)
+        audio['TPE1'] = TPE1(encoding=3, text=new_meta.artist)
+        audio['TCON'] = TCON(encoding=3, text=new_meta.genre)
+        audio['TDRC'] = TDRC(encoding=3, text=new_meta.year)
+        audio['TCOM'] = TCOM(encoding=3, text=new_meta.composer)
+        audio['TPUB'] = TPUB(encoding=3, text=new_meta.label)
+        audio['TIT1'] = TIT1(encoding=3, text=new_meta.grouping)
+
+        # Comment with proper structure
+        audio['COMM::eng'] = COMM(
+            encoding=3,
+            lang='eng',
+            desc='',
+            text=new_meta.comment
+        )
+
+    @staticmethod
+    def _apply_flac(audio, new_meta: MetaData) -> None:
+        """Vorbis comments, addressed by their lower-case field names."""
+        # Save original label/publisher to remixer BEFORE overwriting
+        original_label = audio.get("label", [""])[0] if audio.get("label") else ""
+        original_publisher = audio.get("publisher", [""])[0] if audio.get("publisher") else ""
+        remixer_value = original_label or original_publisher  # Use label first, fallback to publisher
+        audio["title"] = new_meta.title
+        audio["artist"] = new_meta.artist
+        audio["genre"] = new_meta.genre
+        audio["date"] = new_meta.year
+        audio["comment"] = new_meta.comment
+        audio["composer"] = [new_meta.composer]
+        audio["grouping"] = new_meta.grouping
+        # Set remixer to original label/publisher value, unless the file is already tagged with it
+        if remixer_value and remixer_value != new_meta.label:
+            audio["remixer"] = remixer_value
+
+        # Clear label and set new publisher
+        if "label" in audio:
+            del audio["label"]  # Remove label field
+        audio["publisher"] = new_meta.label
+
+    def save(self, path: Union[str, Path, None] = None) -> None:
+        """Write the parsed tags back, to *path* if the file has been renamed since it was opened.
+
+        A ``PermissionError`` (file still held by another program) is retried a few
+        times with a growing delay before it is raised.
+        """
+        if path is not None:
+            self.path = Path(path)
+        # MP3s keep ID3v2.3 for the widest player support
+        kwargs = {"v2_version": 3} if self.format == "mp3" else {}
+        retry_locked(lambda: self.audio.save(self.path, **kwargs), self.SAVE_ATTEMPTS, self.SAVE_RETRY_DELAY)
+
+
+def get_audio_metadata(path: Union[str, Path]) -> Dict[str, str]:
+    """Extract a subset of metadata common across formats using *mutagen*."""
+    return TagSession(path).current
+
+
+def scan_audio_metadata(path: Union[str, Path], header_tags: bool | None = None) -> Dict[str, str]:
+    """Return ``get_audio_metadata(path)``, reading only the tag headers when possible.
+
+    Used for scanning and prefetching: embedded pictures are skipped rather than
+    parsed. Files the header reader does not handle get the full parse. *header_tags*
+    turns the header reader on or off; it defaults to the ``header_tag_reader``
+    setting, which callers scanning many files read once and pass in.
+    """
+    if header_tags is None:
+        header_tags = config_handler.is_header_tag_reader_enabled()
+    if header_tags:
+        header = read_header_tags(path)
+        if header is not None:
+            return TagSession.read_tags(*header)
+    return get_audio_metadata(path)
 
 
 def set_mp4_freeform(tag: MP4, desc: str, value: str) -> None:
@@ -211,161 +445,80 @@ def set_mp4_freeform(tag: MP4, desc: str, value: str) -> None:
     tag[key] = [MP4FreeForm(value.encode("utf-8"), dataformat=1)]
 
 
+def build_index(catalogue: pd.DataFrame | SQLiteCatalogue) -> CatalogueIndex | SQLiteCatalogue:
+    """Return the matching index of a catalogue subset; a ``SQLiteCatalogue`` is its own index."""
+    if isinstance(catalogue, SQLiteCatalogue):
+        return catalogue
+    return CatalogueIndex(catalogue)
+
+
 def find_candidate_rows(
         title: str, 
         catalogue: pd.DataFrame, 
         limit: int = 10, 
-        threshold: int = 60) -> List[int]:
-    """Return indices of the *limit* best candidate rows ranked by fuzzy token sort ratio."""
+        threshold: int = 60,
+        index: CatalogueIndex | SQLiteCatalogue | None = None) -> List[int]:
+    """Return indices of the *limit* best candidate rows ranked by fuzzy token sort ratio.
+
+    Pass a prebuilt *index* of the same catalogue to look exact matches up by hash
+    instead of scanning the whole ``_norm_title`` column, and to prune large
+    catalogues with its trigram index before fuzzy scoring.
+    """
     query = strip_accents(title)
     
     # First check for exact matches
-    exact_matches = catalogue[catalogue["_norm_title"] == query].index.tolist()
+    if index is not None:
+        exact_matches = index.exact_matches(query)
+    else:
+        exact_matches = catalogue[catalogue["_norm_title"] == query].index.tolist()
     if exact_matches:
         return exact_matches[:limit]
     
     # If no exact matches, proceed with fuzzy matching
+    if index is not None:
+        return index.fuzzy_candidates(query, limit=limit, threshold=threshold)
     choices = catalogue["_norm_title"].tolist()
     scored = process.extract(query, choices, scorer=fuzz.token_sort_ratio, limit=limit)
     # scored is a list of tuples (matched string, score, original index)
     return [idx for _, score, idx in scored if score >= threshold]  # adjustable threshold
 
 
+def tag_diff(old: Dict[str, str], new: Dict[str, str]) -> List[tuple]:
+    """Return ``(key, old value, new value, changed)`` for every tag in *old* or *new*, by key."""
+    rows = []
+    for key in sorted(set(old) | set(new)):
+        old_val, new_val = old.get(key, ""), new.get(key, "")
+        rows.append((key, old_val, new_val, old_val != new_val))
+    return rows
+
+
 def preview_diff(old: Dict[str, str], new: Dict[str, str]) -> None:
     """Pretty‑print the tag changes before applying them."""
     print("\nProposed tag updates (empty = unchanged):")
     print(" ──────────────────────────────────────────────────────────")
-    for key in sorted(set(old) | set(new)):
-        old_val, new_val = old.get(key, ""), new.get(key, "")
-        mark = "✓" if old_val != new_val else " "
+    for key, old_val, new_val, changed in tag_diff(old, new):
+        mark = "✓" if changed else " "
         print(f" {mark} {key.capitalize():12} : '{old_val}' → '{new_val}'")
     print(" ──────────────────────────────────────────────────────────\n")
 
-def save_mp3_metadata(path: Path, new_meta: MetaData) -> None:
-    """Write metadata to MP3 using regular ID3 (all fields supported)."""
-    max_retries = 3
-    retry_delay = 0.2
-    
-    for attempt in range(max_retries):
-        try:
-            audio = ID3(path)
-        except:
-            # If no ID3 tag exists, create one
-            audio = ID3()
-        
-        # Standard fields
-        audio.add(TIT2(encoding=3, text=new_meta.title))        # Title
-        audio.add(TPE1(encoding=3, text=new_meta.artist))       # Artist
-        audio.add(TCON(encoding=3, text=new_meta.genre))        # Genre
-        audio.add(TDRC(encoding=3, text=new_meta.year))         # Date/Year
-        audio.add(TCOM(encoding=3, text=new_meta.composer))     # Composer
-        # Get existing label/publisher
-        old_label = ""
-        if 'TPUB' in audio:
-            old_label = str(audio['TPUB'].text[0])
-        # Move old label to remixer field (TPE3)
-        if old_label:
-            audio.add(TPE4(encoding=3, text=old_label))
-        audio.add(TIT1(encoding=3, text=new_meta.grouping))     # Grouping/Content Group
-        audio.add(TPUB(encoding=3, text=new_meta.label))
-        # Comment (requires special structure)
-        audio.add(COMM(encoding=3, lang='eng', desc='', text=new_meta.comment))
-        
-        try:
-            audio.save(path, v2_version=3)
-            return  # Success, exit retry loop
-        except PermissionError:
-            if attempt < max_retries - 1:
-                import time
-                time.sleep(retry_delay * (attempt + 1))  # Exponential backoff
-                continue
-            else:
-                raise
-
-def save_m4a_metadata(path: Path, new_meta: MetaData) -> None:
-    audio = MP4(path)
-    audio["©nam"] = [new_meta.title]
-    audio["©ART"] = [new_meta.artist]
-    audio["©gen"] = [new_meta.genre]
-    audio["©grp"] = [new_meta.grouping]
-    audio["©day"] = [new_meta.year]
-    audio["©cmt"] = new_meta.comment
-    audio["©wrt"] = [new_meta.composer]
-    # audio["©pub"] = [new_meta.label]
-    set_mp4_freeform(audio, "REMIXER", new_meta.pianist)
-    # set_mp4_freeform(audio, "Label", new_meta.label)
-    audio.save()
-
-def save_aiff_metadata(path: Path, new_meta) -> None:
-    """Update AIFF metadata based on existing structure."""
-    audio = AIFF(path)
-    
-    if audio.tags is None:
-        audio.add_tags()
-    
-    # Direct dictionary-style assignment
-    audio.tags['TIT2'] = TIT2(encoding=3, text=new_meta.title)
-    audio.tags['TPE1'] = TPE1(encoding=3, text=new_meta.artist)
-    audio.tags['TCON'] = TCON(encoding=3, text=new_meta.genre)
-    audio.tags['TDRC'] = TDRC(encoding=3, text=new_meta.year)
-    audio.tags['TCOM'] = TCOM(encoding=3, text=new_meta.composer)
-    audio.tags['TPUB'] = TPUB(encoding=3, text=new_meta.label)
-    audio.tags['TIT1'] = TIT1(encoding=3, text=new_meta.grouping)
-    
-    # Comment with proper structure
-    audio.tags['COMM::eng'] = COMM(
-        encoding=3,
-        lang='eng',
-        desc='',
-        text=new_meta.comment
-    )
-    
-    audio.save()
 
+def planned_tags(current: Dict[str, str], new_meta: MetaData) -> Dict[str, str]:
+    """Return the ``get_audio_metadata`` fields *current* tags will read as once *new_meta* is written."""
+    planned = dict(current)
+    planned.update(title=new_meta.title, artist=new_meta.artist, genre=new_meta.genre, date=new_meta.year)
+    # FLAC labels move to the remixer field; other formats never read a label back
+    if "label" in planned:
+        planned["label"] = ""
+    return planned
 
-def save_flac_metadata(path: Path, new_meta: MetaData) -> None:
-    """Write metadata to non-MP3 files using mutagen's File interface."""
-    audio = MutagenFile(path, easy=True)
-    if audio is None:
-        raise ValueError(f"Unsupported file for writing metadata: {path}")
-    
-    # Save original label/publisher to remixer BEFORE overwriting
-    original_label = audio.get("label", [""])[0] if audio.get("label") else ""
-    original_publisher = audio.get("publisher", [""])[0] if audio.get("publisher") else ""
-    remixer_value = original_label or original_publisher  # Use label first, fallback to publisher
-    audio["title"] = new_meta.title
-    audio["artist"] = new_meta.artist
-    audio["genre"] = new_meta.genre
-    audio["date"] = new_meta.year
-    audio["comment"] = new_meta.comment
-    audio["composer"] = [new_meta.composer]
-    audio["grouping"] = new_meta.grouping
-    # Set remixer to original label/publisher value
-    if remixer_value:
-        audio["remixer"] = remixer_value
-    
-    # Clear label and set new publisher
-    if "label" in audio:
-        del audio["label"]  # Remove label field
-    audio["publisher"] = new_meta.label
-
-    new_meta.label
-    # audio["Publisher"] = new_meta.label
-    audio.save()
-
-
-def write_metadata(path: Path, new_meta: Dict[str, str]) -> None:
-    # open without "easy=True" so we can reach low-level tag objects
-    if path.suffix.lower() == ".mp3":
-        save_mp3_metadata(path, new_meta)
-    elif path.suffix.lower() in {".m4a", ".mp4"}:
-        save_m4a_metadata(path, new_meta)
-    elif path.suffix.lower() == ".flac":
-        save_flac_metadata(path, new_meta)
-    elif path.suffix.lower() in (".aif", ".aiff"):
-        save_aiff_metadata(path, new_meta)
-    else:
+def write_metadata(path: Path, new_meta: MetaData) -> None:
+    """Open *path*, apply *new_meta* and save it unless its tags are already up to date."""
+    if path.suffix.lower() not in (".mp3", ".m4a", ".mp4", ".flac", ".aif", ".aiff"):
         print("File Type Unsupported")
+        return
+    session = TagSession(path)
+    if session.apply(new_meta):
+        session.save()
 
 # ───────────────────────────────────────────────────────────────────────────────
 # CLI flow
@@ -389,29 +542,211 @@ def remove_brackets(text: str) -> str:
     return text
 
 
-def ask_choice(file: str, audio_metadata: dict, catalogue: pd.DataFrame) -> int | None:
-    """Interactively ask the user to pick a row; return DataFrame index or None."""
+def open_match_cache() -> MatchCache | None:
+    """Open the persistent match cache, or return None if it is disabled in the config."""
+    return MatchCache() if config_handler.is_match_cache_enabled() else None
+
+
+def prepare_matches(audio_folder, files: List[str], index: CatalogueIndex,
+                    cache: MatchCache | None = None, header_tags: bool | None = None) -> List[tuple]:
+    """Read the tags of every file up front and batch-score their titles against the catalogue.
+
+    Returns a list of ``(file, audio_metadata, candidate_indices, cached_idx)`` tuples in the
+    order of *files*, so the interactive loop only has to read precomputed candidates.
+    Files in a subfolder whose name gives years (see ``folder_year_range``) only get
+    candidates recorded in those years.
+    Files whose fingerprint is in *cache* with a row still present in the catalogue get
+    that row as *cached_idx* and are not scored. *header_tags* is passed to
+    ``scan_audio_metadata``.
+    """
+    if header_tags is None:
+        header_tags = config_handler.is_header_tag_reader_enabled()
+    entries = []
+    cached = {}
+    for file in files:
+        audio_file = Path(audio_folder, file)
+        try:
+            audio_metadata = scan_audio_metadata(audio_file, header_tags)
+        except ValueError as e:
+            print(f"{e}. Skipping...")
+            continue
+        if cache is not None:
+            row_key = cache.get(file_fingerprint(audio_file, audio_metadata))
+            cached_idx = index.row_for_key(row_key) if row_key else None
+            if cached_idx is not None:
+                cached[file] = (audio_metadata, cached_idx)
+                continue
+        entries.append((file, audio_metadata))
+
+    # Files in a subfolder naming years are only matched against those years
+    groups: Dict[Tuple[int, int] | None, List[tuple]] = {}
+    for file, audio_metadata in entries:
+        groups.setdefault(folder_year_range(file), []).append((file, audio_metadata))
+
+    prepared = {}
+    for years, group in groups.items():
+        group_index = index if years is None else index.with_years(*years)
+        for file, audio_metadata, candidate_indices in score_entries(group, group_index):
+            prepared[file] = (file, audio_metadata, candidate_indices, None)
+    for file, (audio_metadata, cached_idx) in cached.items():
+        prepared[file] = (file, audio_metadata, [cached_idx], cached_idx)
+    return [prepared[file] for file in files if file in prepared]
+
+
+def score_entries(entries: List[tuple], index: CatalogueIndex) -> List[tuple]:
+    """Batch-score the titles of ``(file, audio_metadata)`` *entries*; add their candidate indices."""
+    queries = [strip_accents(audio_metadata["title"]) for _, audio_metadata in entries]
+    scored = index.batch_candidates(queries)
+
+    # Second pass for titles without candidates, with bracketed text dropped
+    retries = {}
+    for (_, audio_metadata), query in zip(entries, queries):
+        title = audio_metadata["title"]
+        cleaned_title = remove_brackets(title)
+        if not scored[query] and cleaned_title != title:
+            retries[query] = strip_accents(cleaned_title)
+    rescored = index.batch_candidates(retries.values())
+
+    results = []
+    for (file, audio_metadata), query in zip(entries, queries):
+        candidate_indices = scored[query]
+        if not candidate_indices and query in retries:
+            candidate_indices = rescored[retries[query]]
+        results.append((file, audio_metadata, candidate_indices))
+    return results
+
+
+# Files read and batch-scored together by the prefetch thread
+PREFETCH_WINDOW = 8
+
+
+def prefetch_matches(audio_folder, files: Iterable[str], index: CatalogueIndex,
+                     cache: MatchCache | None = None, window: int = PREFETCH_WINDOW,
+                     header_tags: bool | None = None) -> Iterator[tuple]:
+    """Yield the ``prepare_matches`` entries of *files* while the next ones are prepared.
+
+    A background thread reads and batch-scores *files* one *window* at a time and stays
+    at most two windows ahead of the caller, so the first prompt waits for one window
+    rather than the whole folder and later prompts find their candidates ready.
+    *files* may be a generator such as ``scan_audio_files``; it is consumed by the
+    background thread. Errors raised while preparing are re-raised here. The
+    ``header_tag_reader`` setting is read once, unless *header_tags* is given.
+    """
+    if header_tags is None:
+        header_tags = config_handler.is_header_tag_reader_enabled()
+    files = iter(files)
+    ahead = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    finished = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                ahead.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def prepare_ahead():
+        try:
+            while True:
+                batch_files = list(itertools.islice(files, window))
+                if not batch_files:
+                    break
+                batch = prepare_matches(audio_folder, batch_files, index, cache=cache,
+                                        header_tags=header_tags)
+                if not put(batch):
+                    return
+        except Exception as e:
+            put(e)
+        put(finished)
+
+    threading.Thread(target=prepare_ahead, daemon=True, name="tigertag-prefetch").start()
+    try:
+        while True:
+            batch = ahead.get()
+            if batch is finished:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+    finally:
+        # Lets the thread exit if the caller stops early
+        stop.set()
+
+
+def auto_accept_thresholds() -> Tuple[float, float]:
+    """Return the ``(margin, min_score)`` auto-accept settings, read once for a whole run."""
+    return config_handler.get_auto_accept_margin(), config_handler.get_auto_accept_min_score()
+
+
+def is_confident(ranked: List[tuple], index: CatalogueIndex, titles: List[str],
+                 margin: float | None = None, min_score: float | None = None) -> bool:
+    """Return True if the best of the *ranked* candidates can be used without asking.
+
+    It must beat the runner-up by *margin*, and either score at least *min_score*
+    or have exactly one of the queried *titles* (once normalised), so a weak fuzzy
+    title hit is never accepted on its lead alone. *margin* and *min_score* default
+    to the ``auto_accept_margin`` and ``auto_accept_min_score`` settings; runs pass
+    the ``auto_accept_thresholds`` they read once rather than reading them per file.
+    """
+    if not ranked:
+        return False
+    if min_score is None:
+        min_score = config_handler.get_auto_accept_min_score()
+    best_idx, best_score = ranked[0]
+    if best_score < min_score and not any(best_idx in index.exact_matches(strip_accents(title))
+                                          for title in titles):
+        return False
+    if len(ranked) == 1:
+        return True
+    if margin is None:
+        margin = config_handler.get_auto_accept_margin()
+    return best_score - ranked[1][1] >= margin
+
+
+def ask_choice(file: str, audio_metadata: dict, catalogue: pd.DataFrame,
+               index: CatalogueIndex | None = None,
+               candidate_indices: List[int] | None = None,
+               thresholds: Tuple[float, float] | None = None) -> int | None:
+    """Interactively ask the user to pick a row; return DataFrame index or None.
+
+    *candidate_indices* can be passed in from ``prepare_matches`` to skip fuzzy matching.
+    Candidates are ranked on title, year, orchestra and singer; the best one is used
+    without asking when it beats the runner-up by the configured auto-accept margin
+    and is a strong or exact title match (see ``is_confident``, given the ``(margin,
+    min_score)`` *thresholds*).
+    """
+    if index is None:
+        index = build_index(catalogue)
     
     title = audio_metadata["title"]
+    query_titles = [title, remove_brackets(title)]
 
-    candidate_indices = find_candidate_rows(audio_metadata["title"], catalogue)
+    if candidate_indices is None:
+        candidate_indices = find_candidate_rows(audio_metadata["title"], catalogue, index=index)
     
-    # If no candidates found, try with dropping values in brackes
-    if not candidate_indices:
-        cleaned_title = remove_brackets(title)
-        if cleaned_title != title:  # Only retry if brackets were actually removed
-            candidate_indices = find_candidate_rows(cleaned_title,catalogue)
+        # If no candidates found, try with dropping values in brackes
+        if not candidate_indices:
+            cleaned_title = remove_brackets(title)
+            if cleaned_title != title:  # Only retry if brackets were actually removed
+                candidate_indices = find_candidate_rows(cleaned_title, catalogue, index=index)
                 
     # ask for manual title entry
     if not candidate_indices:
         print("_" * 80,"\n")
         input_title = input(f"No match for '{audio_metadata['title']}', type title here: \n\n\n\n")
-        candidate_indices = find_candidate_rows(input_title, catalogue, threshold=30)
+        candidate_indices = find_candidate_rows(input_title, catalogue, threshold=30, index=index)
+        query_titles = [input_title]
     
     if not candidate_indices:
         print(f"No candidates found for '{input_title}'. Skipping...")
         print("_" * 80)
-        return 9999
+        return SKIPPED
+    
+    ranked = index.rank_candidates(candidate_indices, audio_metadata, titles=query_titles)
+    candidate_indices = [idx for idx, _ in ranked]
     
     # Display file information
     print("\n" + "=" * 80)
@@ -421,24 +756,27 @@ def ask_choice(file: str, audio_metadata: dict, catalogue: pd.DataFrame) -> int
     print(f"  Album: {audio_metadata.get('album', 'N/A')}")
     print("=" * 80)
     
-    # If only one candidate, use it automatically
+    # If only one candidate, or one clearly ahead of the rest, use it automatically
     if len(candidate_indices) == 1:
         # print("\n>>> Only one candidate found - using it automatically <<<")
         # print("_"*80, "\n"*5)
         return candidate_indices[0]
+    if is_confident(ranked, index, query_titles, *(thresholds or ())):
+        print(f">>> Auto-selected best match (score {ranked[0][1]:.0f} vs {ranked[1][1]:.0f}) <<<\n")
+        return candidate_indices[0]
     
     # Display all candidates
     # print(f"\nFOUND {len(candidate_indices)} POSSIBLE MATCHES:\n")
     
-    for n, idx in enumerate(candidate_indices, 1):
-        row = catalogue.loc[idx]
+    for n, (idx, score) in enumerate(ranked, 1):
+        row = index.row(idx)
         title = row.get('Title', 'N/A')
         artist = row.get('Orchestra', 'N/A')
         singer = row.get('Singer', 'N/A')
         date = row.get('Date', 'N/A')
         
         # Format with padding for alignment
-        print(f"  [{n}]  {title[:25]:<25}  | {singer[:25]:<25} | {artist[:25]:<25}  |  {date}")
+        print(f"  [{n}]  {title[:25]:<25}  | {singer[:25]:<25} | {artist[:25]:<25}  |  {date}  |  {score:.0f}")
         
         # Add separator between choices (except after last one)
         if n < len(candidate_indices):
@@ -454,7 +792,7 @@ def ask_choice(file: str, audio_metadata: dict, catalogue: pd.DataFrame) -> int
             i = int(choice)
             if i == 0:
                 print(">>> Skipped <<<\n")
-                return 9999
+                return SKIPPED
             if 1 <= i <= len(candidate_indices):
                 print(f">>> Selected option {i} <<<\n")
                 return candidate_indices[i - 1]
@@ -466,17 +804,37 @@ def ask_choice(file: str, audio_metadata: dict, catalogue: pd.DataFrame) -> int
 # csv_path = main_folder + "/Discography of Osvaldo Pugliese.csv"
 # df = load_catalogue(csv_path)
 
-def print_filename_changes_table(filename_changes: List[tuple]) -> None:
-    """Print a formatted table showing all filename changes."""
+def filename_change(old_path: Path, new_path: Path) -> Tuple[str, str]:
+    """The ``(old_path, new_path)`` entry of a rename, as absolute paths.
+
+    Full paths, not names: a recursive scan can rename files of the same name in
+    different subfolders, and the Virtual DJ database must tell them apart.
+    """
+    return os.path.abspath(old_path), os.path.abspath(new_path)
+
+
+def print_filename_changes_table(filename_changes: List[tuple], unchanged_count: int = 0) -> None:
+    """Print a formatted table showing all filename changes.
+
+    Paths are shown relative to the folder holding all the renamed files, so a
+    single folder shows bare filenames. *unchanged_count* is the number of files
+    whose tags were already up to date and were therefore not rewritten.
+    """
     if not filename_changes:
         print("\n" + "=" * 80)
         print("No filename changes were made.")
+        if unchanged_count:
+            print(f"Files already up to date (not rewritten): {unchanged_count}")
         print("=" * 80 + "\n")
         return
     
     print("\n" + "=" * 80)
     print("FILENAME CHANGES SUMMARY")
     print("=" * 80)
+
+    base = os.path.commonpath([os.path.dirname(path) for change in filename_changes for path in change])
+    filename_changes = [(os.path.relpath(old, base), os.path.relpath(new, base))
+                        for old, new in filename_changes]
     
     # Calculate column widths
     max_old_len = max(len(old) for old, _ in filename_changes) if filename_changes else 0
@@ -497,80 +855,660 @@ def print_filename_changes_table(filename_changes: List[tuple]) -> None:
     
     print("=" * 80)
     print(f"Total files renamed: {len(filename_changes)}")
+    if unchanged_count:
+        print(f"Files already up to date (not rewritten): {unchanged_count}")
     print("=" * 80 + "\n")
 
 
-def update_tags(audio_folder, catalogue):
-    filename_changes = []  # List of tuples: (old_filename, new_filename)
-    
-    for file in os.listdir(audio_folder):
-        if not file.endswith(('.mp3', '.flac', '.m4a', '.mp4', "aif")):
-        # if not file.endswith(('.mp3')):
-            print(f"File {file} is of incompatible type. Skipping...")
-            continue
-        audio_file = Path(audio_folder, file)
-        audio_metadata = get_audio_metadata(audio_file)
+def remember_match(cache: MatchCache | None, path: Path, row_key: str,
+                   audio_metadata: Dict[str, str] | None = None) -> None:
+    """Store *row_key* under the current fingerprint of *path* so later runs skip matching it."""
+    if cache is None:
+        return
+    try:
+        if audio_metadata is None:
+            audio_metadata = get_audio_metadata(path)
+        cache.put(file_fingerprint(path, audio_metadata), row_key, path)
+    except (OSError, ValueError) as e:
+        print(f"Could not cache match for {Path(path).name}: {str(e)}")
 
-        chosen_idx = ask_choice(file, audio_metadata, catalogue)
-        if chosen_idx != 9999:
-            new_metadata = get_updated_metadata(catalogue.loc[chosen_idx].to_dict())
-            try:
-                old_filename = audio_file.name
-                old_path_resolved = audio_file.resolve()
-                
-                # Unload file from player before any file operations
-                # self.root.after(0, lambda: self.music_player.unload_file()) # This line is from gui.py, not tag_updater.py
-                # Wait longer to ensure file is fully released
-                import time
-                time.sleep(0.3)  # Increased delay
-                
-                # First rename the file
-                new_path = update_filename(
-                    audio_file, 
-                    new_metadata.title,
-                    new_metadata.orchestra,
-                    new_metadata.year,
-                    format_type="orchestra - title - year",  # Default for non-GUI usage
-                    orchestra_last_name=new_metadata.orchestra_last_name,
-                    singer_last_name=new_metadata.singer_last_name,
-                    )
-                new_filename = new_path.name
-                new_path_resolved = new_path.resolve()
-                
-                if old_path_resolved != new_path_resolved:
-                    filename_changes.append((old_filename, new_filename))
-                
-                # Ensure file is not loaded in player before writing metadata
-                # self.root.after(0, lambda: self.music_player.unload_file()) # This line is from gui.py, not tag_updater.py
-                time.sleep(0.2)  # Additional delay before metadata write
-                
-                # Write metadata to the file
-                try:
-                    write_metadata(new_path, new_metadata)
-                    print(f"Updated metadata for: {new_filename}")
-                except PermissionError as pe:
-                    print(f"Permission denied writing metadata for {new_filename}: {str(pe)}")
-                    print("File may still be locked. Retrying after delay...")
-                    time.sleep(0.5)
-                    write_metadata(new_path, new_metadata)
-                    print(f"Successfully updated metadata for: {new_filename} on retry")
-                except Exception as meta_error:
-                    print(f"Error updating metadata for {new_filename}: {str(meta_error)}")
-                    import traceback
-                    traceback.print_exc()
-                
-                # Update player with new path AFTER metadata is written
-                if old_path_resolved != new_path_resolved:
-                    # self.root.after(0, lambda p=new_path: self.music_player.load_file(str(p))) # This line is from gui.py, not tag_updater.py
-                    pass # No music player integration in tag_updater.py
-                
-            except Exception as e:
-                print(f"Error processing {file}: {str(e)}")
-                import traceback
-                traceback.print_exc()
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a', '.mp4', '.aif', '.aiff')
+
+
+def _compile_patterns(patterns: Iterable[str] | None):
+    """Combine glob *patterns* into one case-insensitive regex, or None if there are none."""
+    patterns = list(patterns or [])
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE)
+
+
+def _matches(pattern, relative_path: str) -> bool:
+    """Return True if the compiled glob *pattern* matches *relative_path* or its last part."""
+    relative_path = relative_path.replace(os.sep, "/")
+    return bool(pattern.match(relative_path) or pattern.match(relative_path.rsplit("/", 1)[-1]))
+
+
+def scan_audio_files(audio_folder, recursive: bool = True, include: Iterable[str] | None = None,
+                     exclude: Iterable[str] | None = None, report_skipped: bool = True) -> Iterator[str]:
+    """
+    Yield the paths, relative to *audio_folder*, of the supported audio files below it.
+
+    Folders are listed lazily with ``os.scandir``, so the first files reach the
+    matching pipeline while the rest of a large library is still being walked.
+    A folder's files come first, then its subfolders, each in name order.
+
+    Parameters:
+    -----------
+    audio_folder : str or Path
+        Folder to scan
+    recursive : bool
+        Also scan subfolders (symlinked folders are not followed)
+    include : list of str, optional
+        Glob patterns (e.g. ``"*.flac"``); only files whose relative path or name
+        matches one of them are yielded
+    exclude : list of str, optional
+        Glob patterns of files and folders to leave out; excluded folders are not entered
+    report_skipped : bool
+        Print the files skipped for having an unsupported type
+    """
+    include_pattern = _compile_patterns(include)
+    exclude_pattern = _compile_patterns(exclude)
+    pending = [""]
+    while pending:
+        relative_folder = pending.pop()
+        try:
+            with os.scandir(os.path.join(audio_folder, relative_folder)) as scan:
+                entries = sorted(scan, key=lambda entry: entry.name)
+        except OSError as e:
+            print(f"Could not read folder {relative_folder or audio_folder}: {str(e)}. Skipping...")
+            continue
+        subfolders = []
+        for entry in entries:
+            relative_path = os.path.join(relative_folder, entry.name)
+            if exclude_pattern is not None and _matches(exclude_pattern, relative_path):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                subfolders.append(relative_path)
+                continue
+            if not entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                if report_skipped:
+                    print(f"File {relative_path} is of incompatible type. Skipping...")
                 continue
+            if include_pattern is not None and not _matches(include_pattern, relative_path):
+                continue
+            yield relative_path
+        if recursive:
+            # Popped from the end, so reversed to visit them in name order
+            pending.extend(reversed(subfolders))
+
+
+def list_audio_files(audio_folder, report_skipped: bool = True) -> List[str]:
+    """Return the names of the supported audio files in *audio_folder*."""
+    return list(scan_audio_files(audio_folder, recursive=False, report_skipped=report_skipped))
+
+
+def folder_year_range(file: str) -> Tuple[int, int] | None:
+    """Return the years named by the nearest subfolder in the relative path *file*, or None.
+
+    ``"DArienzo/1935-1940/CD1/x.mp3"`` -> ``(1935, 1940)``. The scanned folder itself
+    is not part of *file*; its years already select the catalogue subset.
+    """
+    folder = Path(file).parent
+    while folder.name:
+        start_year, end_year = parse_years_from_folder(folder)
+        if start_year is not None:
+            return start_year, end_year
+        folder = folder.parent
+    return None
+
+
+def apply_match(audio_file: Path, new_metadata: MetaData, format_type: str,
+                cache: MatchCache | None = None, row_key: str | None = None,
+                release_file=None, unchanged: List[str] | None = None,
+                errors: List[tuple] | None = None, new_path: Path | None = None,
+                journal: RunJournal | None = None, planner: RenamePlanner | None = None,
+                rename: bool = True) -> Path:
+    """Rename *audio_file* after its new metadata, then write the tags; return the new path.
+
+    A *new_path* decided beforehand (by a plan) is used instead of the *format_type* name;
+    without *rename* the file has already been moved to its final name and only its
+    tags are written.
+    Name collisions are resolved by *planner*, shared by the files of a run so each
+    folder is listed once. The rename and the tag write are recorded in *journal* as
+    they complete.
+
+    *release_file* is called with *audio_file* before the file is touched so a caller
+    holding it open (the GUI player) can let go of it, and must return once it has.
+    A rename or save the OS refuses because the file is still locked is retried
+    briefly. Files whose tags are already up to date are not saved again; their names
+    are appended to *unchanged*. Metadata write errors are reported, not raised, and
+    appended to *errors* as ``(filename, message)``.
+    """
+    if release_file is not None:
+        release_file(audio_file)
+
+    # Parse the tags once; they are updated and saved under the new name
+    session = TagSession(audio_file)
+    
+    # First rename the file
+    if not rename:
+        new_path = audio_file
+    else:
+        if new_path is None:
+            new_path = build_filename(
+                audio_file,
+                new_metadata.title,
+                new_metadata.orchestra,
+                new_metadata.year,
+                format_type=format_type,
+                orchestra_last_name=new_metadata.orchestra_last_name,
+                singer_last_name=new_metadata.singer_last_name,
+                )
+        if planner is None:
+            planner = RenamePlanner(retry=retry_locked)
+        new_path = planner.rename(audio_file, new_path)
+        if journal is not None:
+            journal.record("renamed", path=str(audio_file), new_path=str(new_path))
+    new_filename = new_path.name
     
-    # Print summary table at the end
-    print_filename_changes_table(filename_changes)
+    # Write metadata to the file
+    try:
+        up_to_date = not session.apply(new_metadata)
+        if up_to_date:
+            print(f"Metadata already up to date for: {new_filename}")
+            if unchanged is not None:
+                unchanged.append(new_filename)
+        else:
+            session.save(new_path)
+            print(f"Updated metadata for: {new_filename}")
+        if journal is not None:
+            journal.record("written", path=str(new_path), unchanged=up_to_date)
+        if row_key is not None:
+            remember_match(cache, new_path, row_key, session.read())
+    except Exception as meta_error:
+        print(f"Error updating metadata for {new_filename}: {str(meta_error)}")
+        traceback.print_exc()
+        if errors is not None:
+            errors.append((new_filename, str(meta_error)))
+        if journal is not None:
+            journal.record("failed", path=str(new_path), error=str(meta_error))
+    return new_path
+
+
+class WriteBehind:
+    """Apply accepted matches on a bounded pool of worker threads.
+
+    The thread deciding matches hands each one to ``submit`` and moves straight on
+    to the next file while the rename and tag save run in the background. At most
+    twice *max_workers* matches wait for a worker; beyond that ``submit`` blocks.
+    Failures are reported as they happen and summarised by ``close``.
+
+    Parameters:
+    -----------
+    format_type : str
+        Filename format passed to ``apply_match``
+    cache : MatchCache, optional
+        Match cache updated with each written file
+    release_file : callable, optional
+        Called with a file's path before it is renamed or written, see ``apply_match``
+    after_write : callable, optional
+        Called with a file's old and new path once it has been renamed and written
+    max_workers : int, optional
+        Number of worker threads (default: the ``write_workers`` config setting)
+    journal : RunJournal, optional
+        Journal recording each rename and tag write
+    """
+
+    def __init__(self, format_type: str, cache: MatchCache | None = None, release_file=None,
+                 max_workers: int | None = None, journal: RunJournal | None = None, after_write=None):
+        self.format_type = format_type
+        self.cache = cache
+        self.release_file = release_file
+        self.after_write = after_write
+        self.journal = journal
+        # Shared by the workers: collisions are resolved against one listing per folder
+        self.planner = RenamePlanner(retry=retry_locked)
+        max_workers = max_workers or config_handler.get_write_workers()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tigertag-write")
+        self.slots = threading.BoundedSemaphore(2 * max_workers)
+        self.futures = []
+        self.filename_changes: List[tuple] = []  # (old_path, new_path), in submission order
+        self.unchanged: List[str] = []  # Files whose tags were already up to date
+        self.errors: List[tuple] = []  # (filename, error message)
+
+    def __enter__(self) -> "WriteBehind":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def submit(self, audio_file: Path, new_metadata: MetaData, row_key: str | None = None,
+               new_path: Path | None = None, rename: bool = True) -> None:
+        """Queue *audio_file* to be renamed (to *new_path* if given, not at all without
+        *rename*) and tagged with *new_metadata*."""
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self._apply, audio_file, new_metadata, row_key, new_path, rename)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def _apply(self, audio_file: Path, new_metadata: MetaData, row_key: str | None,
+               new_path: Path | None, rename: bool = True):
+        """Worker body: return ``(old_path, new_path)`` if the file was renamed."""
+        try:
+            new_path = apply_match(audio_file, new_metadata, self.format_type, cache=self.cache,
+                                   row_key=row_key, release_file=self.release_file,
+                                   unchanged=self.unchanged, errors=self.errors, new_path=new_path,
+                                   journal=self.journal, planner=self.planner, rename=rename)
+            if self.after_write is not None:
+                self.after_write(audio_file, new_path)
+            if new_path != audio_file:
+                return filename_change(audio_file, new_path)
+        except Exception as e:
+            print(f"Error processing {audio_file.name}: {str(e)}")
+            traceback.print_exc()
+            self.errors.append((audio_file.name, str(e)))
+            if self.journal is not None:
+                self.journal.record("failed", path=str(audio_file), error=str(e))
+        return None
+
+    def close(self) -> List[tuple]:
+        """Wait for every queued file; report failures and return the filename changes."""
+        self.executor.shutdown(wait=True)
+        self.filename_changes = [change for change in (f.result() for f in self.futures) if change]
+        if self.errors:
+            print(f"\n{len(self.errors)} file(s) could not be updated:")
+            for filename, message in self.errors:
+                print(f"  {filename}: {message}")
+        return self.filename_changes
+
+
+def start_journal(audio_folder, resume: bool = False) -> Tuple[RunJournal, JournalState | None]:
+    """Start the journal of a run over *audio_folder*; with *resume*, continue an interrupted one.
+
+    Returns the journal and what the interrupted run had done (None for a new run).
+    """
+    journal = RunJournal.for_folder(audio_folder)
+    state = journal.load() if resume else None
+    if resume and state is None:
+        print("No interrupted run to resume; starting a new one.")
+    elif state is not None:
+        print(f"Resuming interrupted run: {len(state.done)} file(s) already written, "
+              f"{len(state.decisions)} decision(s) recorded")
+    journal.start(resume=state is not None)
+    return journal, state
+
+
+def journal_choice(state: JournalState | None, audio_file: Path, index: CatalogueIndex) -> int | None:
+    """Return the choice recorded for *audio_file* by an interrupted run (``SKIPPED`` if it
+    was skipped), or None if it was not decided or its row is no longer in the catalogue."""
+    if state is None or str(audio_file) not in state.decisions:
+        return None
+    row_key = state.decisions[str(audio_file)]
+    if row_key is None:
+        return SKIPPED
+    return index.row_for_key(row_key)
+
+
+def record_choice(journal: RunJournal, audio_file: Path, index: CatalogueIndex, chosen_idx: int) -> None:
+    """Journal the choice made for *audio_file*, so a resumed run does not ask again."""
+    row_key = None if chosen_idx == SKIPPED else index.row_key(chosen_idx)
+    journal.record("decided", path=str(audio_file), row_key=row_key)
+
+
+def run_tag_update(audio_folder, catalogue, format_type: str = "orchestra - title - year",
+                   files: Iterable[str] | None = None, resume: bool = False, choose=None,
+                   release_file=None, after_write=None, after_writes=None) -> List[tuple]:
+    """
+    Match every file of *audio_folder*, then rename and tag it: the driver shared by the CLI and the GUI.
+
+    Files are read and scored ahead of their prompt, and renames and tag writes
+    run in the background so the next prompt never waits on disk I/O. Every
+    decision, rename and tag write is journaled; with *resume* an interrupted run
+    over the folder picks up where it stopped.
+
+    Parameters:
+    -----------
+    audio_folder : str or Path
+        Folder to tag
+    catalogue : pd.DataFrame or SQLiteCatalogue
+        Catalogue subset to match against
+    format_type : str
+        Filename format of the renamed files
+    files : iterable of str, optional
+        Paths relative to *audio_folder* (default: its audio files, see ``scan_audio_files``)
+    resume : bool
+        Continue an interrupted run over the folder instead of starting over
+    choose : callable, optional
+        Decides a file without a cached or journaled match; called like ``ask_choice``
+        (the default) and returns the chosen row or ``SKIPPED``
+    release_file : callable, optional
+        Before-write hook passed to ``WriteBehind``
+    after_write : callable, optional
+        After-write hook passed to ``WriteBehind``
+    after_writes : callable, optional
+        Called with the ``(old, new)`` filename changes once every file is written,
+        before the run is marked finished, so an interruption there is resumed too
+
+    Returns:
+    --------
+    list : ``(old_path, new_path)`` changes, including those of an interrupted run
+    """
+    index = build_index(catalogue)  # built once, reused for every file
+    thresholds = auto_accept_thresholds()
+    choose = choose or ask_choice
+    cache = open_match_cache()
+    journal, resumed = start_journal(audio_folder, resume)
+    if files is None:
+        files = scan_audio_files(audio_folder)
+    if resumed is not None:
+        files = (file for file in files if str(Path(audio_folder, file)) not in resumed.done)
+
+    prepared = prefetch_matches(audio_folder, files, index, cache=cache)
+    try:
+        with WriteBehind(format_type, cache=cache, release_file=release_file, journal=journal,
+                         after_write=after_write) as writer:
+            for file, audio_metadata, candidate_indices, cached_idx in prepared:
+                audio_file = Path(audio_folder, file)
+
+                chosen_idx = journal_choice(resumed, audio_file, index)
+                if chosen_idx is not None:
+                    print(f"Using decision of the interrupted run for: {file}")
+                else:
+                    if cached_idx is not None:
+                        print(f"Using cached match for: {file}")
+                        chosen_idx = cached_idx
+                    else:
+                        chosen_idx = choose(file, audio_metadata, catalogue, index=index,
+                                            candidate_indices=candidate_indices, thresholds=thresholds)
+                    record_choice(journal, audio_file, index, chosen_idx)
+                if chosen_idx != SKIPPED:
+                    row_key = index.row_key(chosen_idx)
+                    new_metadata = get_updated_metadata(index.row(chosen_idx).to_dict())
+                    writer.submit(audio_file, new_metadata, row_key)
+
+        if cache is not None:
+            cache.close()
+
+        # Print summary table at the end, including what the interrupted run had done
+        filename_changes = (resumed.filename_changes if resumed else []) + writer.filename_changes
+        unchanged_count = len(resumed.unchanged if resumed else []) + len(writer.unchanged)
+        print_filename_changes_table(filename_changes, unchanged_count)
+        if after_writes is not None:
+            after_writes(filename_changes)
+        journal.finish()
+    finally:
+        journal.close()
+
     print("\n\n >>> Finished updating folder! <<< \n\n\n")
+    return filename_changes
+
+
+def update_tags(audio_folder, catalogue, format_type: str = "orchestra - title - year",
+                recursive: bool = False, include: List[str] | None = None,
+                exclude: List[str] | None = None, resume: bool = False) -> List[tuple]:
+    """Tag *audio_folder* interactively (see ``run_tag_update``); *recursive*, *include*
+    and *exclude* select the files as in ``scan_audio_files``."""
+    files = scan_audio_files(audio_folder, recursive=recursive, include=include, exclude=exclude)
+    return run_tag_update(audio_folder, catalogue, format_type, files=files, resume=resume)
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Headless flow
+# ───────────────────────────────────────────────────────────────────────────────
+
+def auto_choice(audio_metadata: dict, index: CatalogueIndex,
+                candidate_indices: List[int], thresholds: Tuple[float, float] | None = None) -> tuple:
+    """Decide a match without asking; return ``(chosen_idx or None, ranked candidates)``.
+
+    Mirrors ``ask_choice``: files without title candidates get no decision, and a
+    candidate is only chosen when ``is_confident`` accepts it. Unlike ``ask_choice``,
+    a single candidate is not taken on that alone: nobody sees the file before it is
+    renamed. *thresholds* are the run's ``auto_accept_thresholds``.
+    """
+    title = audio_metadata["title"]
+    titles = [title, remove_brackets(title)]
+    ranked = index.rank_candidates(candidate_indices, audio_metadata, titles=titles)
+    if is_confident(ranked, index, titles, *(thresholds or ())):
+        return ranked[0][0], ranked
+    return None, ranked
+
+
+def review_item(audio_file: Path, audio_metadata: dict, index: CatalogueIndex,
+                ranked: List[tuple]) -> dict:
+    """Build the review queue entry for a file that could not be matched automatically."""
+    candidates = []
+    for idx, score in ranked:
+        row = index.row(idx)
+        candidates.append({
+            "row_key": index.row_key(idx),
+            "title": row.get("Title", ""),
+            "orchestra": row.get("Orchestra", ""),
+            "singer": row.get("Singer", ""),
+            "date": row.get("Date", "") or "",
+            "score": round(score, 1),
+        })
+    return {
+        "path": str(audio_file),
+        "tags": audio_metadata,
+        "candidates": candidates,
+        "choice": None,
+    }
+
+
+def update_tags_headless(audio_folder, catalogue, queue_path: Path,
+                         format_type: str = "orchestra last - title - singer last - year",
+                         recursive: bool = False, include: List[str] | None = None,
+                         exclude: List[str] | None = None) -> List[tuple]:
+    """Run the tag updater on *audio_folder* without prompting.
+
+    Confident matches are applied straight away; every other file is written to the
+    JSON review queue at *queue_path* with its top candidates, to be decided later and
+    applied with ``apply_review_queue``. *recursive*, *include* and *exclude* select
+    the files as in ``scan_audio_files``. Returns the ``(old, new)`` filename changes.
+    """
+    index = build_index(catalogue)
+    thresholds = auto_accept_thresholds()
+    cache = open_match_cache()
+    files = scan_audio_files(audio_folder, recursive=recursive, include=include, exclude=exclude)
+    queue = []
+
+    prepared = prefetch_matches(audio_folder, files, index, cache=cache)
+    with WriteBehind(format_type, cache=cache) as writer:
+        for file, audio_metadata, candidate_indices, cached_idx in prepared:
+            audio_file = Path(audio_folder, file)
+            if cached_idx is not None:
+                print(f"Using cached match for: {file}")
+                chosen_idx = cached_idx
+            else:
+                chosen_idx, ranked = auto_choice(audio_metadata, index, candidate_indices, thresholds)
+                if chosen_idx is None:
+                    print(f"Queued for review: {file}")
+                    queue.append(review_item(audio_file, audio_metadata, index, ranked))
+                    continue
+
+            row_key = index.row_key(chosen_idx)
+            new_metadata = get_updated_metadata(index.row(chosen_idx).to_dict())
+            writer.submit(audio_file, new_metadata, row_key)
+    filename_changes = writer.filename_changes
+
+    if cache is not None:
+        cache.close()
+
+    with open(queue_path, "w", encoding="utf-8") as f:
+        json.dump({"folder": str(audio_folder), "format": format_type, "items": queue},
+                  f, indent=2, ensure_ascii=False)
+
+    print_filename_changes_table(filename_changes, len(writer.unchanged))
+    print(f"{len(queue)} file(s) written to review queue: {queue_path}")
+    return filename_changes
+
+
+def apply_review_queue(queue_path: Path, catalogue) -> List[tuple]:
+    """Apply the decisions recorded in a review queue written by ``update_tags_headless``.
+
+    Each item's ``choice`` is the 1-based number of the chosen candidate; ``null`` or
+    ``0`` leaves the file untouched, and any other value is reported and skipped. Returns the ``(old, new)`` filename changes.
+    """
+    with open(queue_path, "r", encoding="utf-8") as f:
+        queue = json.load(f)
+
+    index = build_index(catalogue)
+    cache = open_match_cache()
+    with WriteBehind(queue["format"], cache=cache) as writer:
+        for item in queue["items"]:
+            audio_file = Path(item["path"])
+            choice = item.get("choice")
+            if not choice:
+                continue
+            try:
+                number = int(choice)
+            except (TypeError, ValueError):
+                number = None  # hand-edited to something other than a number
+            if number is None or not 1 <= number <= len(item["candidates"]):
+                print(f"Invalid choice {choice!r} for {audio_file.name}. Skipping...")
+                continue
+            row_key = item["candidates"][number - 1]["row_key"]
+            chosen_idx = index.row_for_key(row_key)
+            if chosen_idx is None:
+                print(f"Catalogue row '{row_key}' not found for {audio_file.name}. Skipping...")
+                continue
+            if not audio_file.is_file():
+                print(f"File not found: {audio_file}. Skipping...")
+                continue
+
+            new_metadata = get_updated_metadata(index.row(chosen_idx).to_dict())
+            writer.submit(audio_file, new_metadata, row_key)
+
+    if cache is not None:
+        cache.close()
+
+    print_filename_changes_table(writer.filename_changes, len(writer.unchanged))
+    return writer.filename_changes
+
+
+# ───────────────────────────────────────────────────────────────────────────────
+# Plan mode
+# ───────────────────────────────────────────────────────────────────────────────
+
+def plan_tags(audio_folder, catalogue, plan_path: Path,
+              format_type: str = "orchestra last - title - singer last - year",
+              recursive: bool = False, include: List[str] | None = None,
+              exclude: List[str] | None = None) -> dict:
+    """Match *audio_folder* and write what applying the matches would do, without touching any file.
+
+    Files are matched as by ``update_tags_headless`` (cached or confident matches only).
+    The JSON plan at *plan_path* lists, for each matched file, its current and new
+    path, the ``preview_diff`` tag changes, the chosen catalogue row and the metadata
+    to write; unmatched files are listed separately. Items can be removed from the
+    plan before it is carried out with ``apply_plan``. Returns the plan.
+    """
+    index = build_index(catalogue)
+    thresholds = auto_accept_thresholds()
+    cache = open_match_cache()
+    files = scan_audio_files(audio_folder, recursive=recursive, include=include, exclude=exclude)
+    items, unmatched = [], []
+    rows = []  # Chosen catalogue row of each item
+
+    for file, audio_metadata, candidate_indices, cached_idx in prefetch_matches(
+            audio_folder, files, index, cache=cache):
+        audio_file = Path(audio_folder, file)
+        chosen_idx = cached_idx
+        if chosen_idx is None:
+            chosen_idx, _ = auto_choice(audio_metadata, index, candidate_indices, thresholds)
+        if chosen_idx is None:
+            unmatched.append(str(audio_file))
+            continue
+
+        row = index.row(chosen_idx).to_dict()
+        rows.append(row)
+        new_metadata = get_updated_metadata(row)
+
+        items.append({
+            "path": str(audio_file),
+            "new_path": None,  # named below, together with the other items
+            "row_key": index.row_key(chosen_idx),
+            "tags": {key: [old_val, new_val]
+                     for key, old_val, new_val, changed in tag_diff(audio_metadata,
+                                                                    planned_tags(audio_metadata, new_metadata))
+                     if changed},
+            "metadata": asdict(new_metadata),
+        })
+
+    if cache is not None:
+        cache.close()
+
+    # Every item is named in one go, and collisions resolved for the whole batch:
+    # with other files and with each other
+    stems = compile_filename_template(format_type).stems(pd.DataFrame(rows, dtype=object)) if rows else []
+    targets = []
+    for item, stem in zip(items, stems):
+        path = Path(item["path"])
+        targets.append((path, path.with_name(f"{stem}{path.suffix.lower()}")))
+    for item, (_, new_path) in zip(items, RenamePlanner().plan(targets)):
+        item["new_path"] = str(new_path)
+
+    plan = {"folder": str(audio_folder), "format": format_type, "items": items, "unmatched": unmatched}
+    with open(plan_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=2, ensure_ascii=False)
+
+    renamed = sum(item["path"] != item["new_path"] for item in items)
+    print(f"Planned {len(items)} file(s): {renamed} renamed, "
+          f"{sum(bool(item['tags']) for item in items)} with tag changes")
+    print(f"{len(unmatched)} file(s) without a confident match")
+    print(f"Plan written to: {plan_path}")
+    return plan
+
+
+def print_plan(plan: dict) -> None:
+    """Print the renames and tag changes of a plan written by ``plan_tags``, for review."""
+    for item in plan["items"]:
+        old_name, new_name = Path(item["path"]).name, Path(item["new_path"]).name
+        print(f"{old_name}  →  {new_name}" if old_name != new_name else f"{old_name}  (name kept)")
+        old = {key: values[0] for key, values in item["tags"].items()}
+        new = {key: values[1] for key, values in item["tags"].items()}
+        if old:
+            preview_diff(old, new)
+    for path in plan.get("unmatched", []):
+        print(f"Unmatched: {Path(path).name}")
+
+
+def apply_plan(plan_path: Path) -> List[tuple]:
+    """Carry out the plan written by ``plan_tags`` as one batch of renames, then parallel tag writes.
+
+    All files are renamed first, in an order that never overwrites a file of the
+    batch (a rename cycle goes through a temporary name), to their planned paths or
+    a numbered one if the name has been taken since. They are then tagged with the
+    planned metadata; the catalogue is not needed. Returns the ``(old, new)`` filename changes.
+    """
+    with open(plan_path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+
+    items = []
+    for item in plan["items"]:
+        if not Path(item["path"]).is_file():
+            print(f"File not found: {item['path']}. Skipping...")
+            continue
+        items.append(item)
+
+    cache = open_match_cache()
+    planner = RenamePlanner(retry=retry_locked)
+    with WriteBehind(plan["format"], cache=cache) as writer:
+        moved = planner.execute(planner.plan((Path(item["path"]), Path(item["new_path"])) for item in items),
+                                errors=writer.errors)
+        filename_changes = [filename_change(old, new) for old, new in moved.items() if old != new]
+        for item in items:
+            new_path = moved.get(Path(item["path"]))
+            if new_path is not None:
+                writer.submit(new_path, MetaData(**item["metadata"]), item.get("row_key"), rename=False)
+
+    if cache is not None:
+        cache.close()
 
+    print_filename_changes_table(filename_changes, len(writer.unchanged))
+    return filename_changes
@@ -4,6 +4,13 @@ from pathlib import Path
 from typing import List, Tuple, Optional
 import shutil
 from datetime import datetime
+import os
+
+
+def _path_key(path: Path) -> str:
+    """Comparable form of a file path: absolute, forward slashes, lowercase."""
+    return os.path.abspath(path).replace('\\', '/').lower()
+
 
 def update_vdj_database(
     vdj_db_path: str,
@@ -18,9 +25,10 @@ def update_vdj_database(
     vdj_db_path : str
         Path to the Virtual DJ database.xml file
     filename_changes : List[Tuple[str, str]]
-        List of (old_filename, new_filename) tuples
+        List of (old_path, new_path) tuples
     audio_folder : str
-        Path to the audio folder containing the files
+        Path to the audio folder containing the files; relative paths in
+        *filename_changes* are taken relative to it
     
     Returns:
     --------
@@ -47,11 +55,11 @@ def update_vdj_database(
         
         updated_count = 0
         
-        # Create a mapping of old to new filenames (case-insensitive for Windows)
+        # Map old to new full paths: files of the same name in different subfolders
+        # are different songs (case-insensitive for Windows)
         filename_map = {}
         for old, new in filename_changes:
-            # Store lowercase version for case-insensitive matching
-            filename_map[old.lower()] = new
+            filename_map[_path_key(audio_folder_path / old)] = Path(new).name
         
         # Find all Song elements and update FilePath attributes
         for song in root.findall('.//Song'):
@@ -65,13 +73,10 @@ def update_vdj_database(
             except:
                 continue
             
-            # Get the filename from the filepath
-            old_filename = filepath.name
-            old_filename_lower = old_filename.lower()
-            
-            # Check if this filename matches any of our renamed files (case-insensitive)
-            if old_filename_lower in filename_map:
-                new_filename = filename_map[old_filename_lower]
+            # Check if this file is one of our renamed files (case-insensitive)
+            old_path_key = _path_key(filepath)
+            if old_path_key in filename_map:
+                new_filename = filename_map[old_path_key]
                 
                 # Update the filepath - preserve the directory structure
                 new_filepath = filepath.parent / new_filename
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The application modules import each other by their flat module names
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "tigertag"))
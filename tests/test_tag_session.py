@@ -0,0 +1,81 @@
+"""Re-applying the tags a file was just saved with must leave nothing to save."""
+import struct
+
+import pytest
+from mutagen.aiff import AIFF
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3, TIT2, TPUB
+from mutagen.mp4 import MP4
+
+from tag_updater import MetaData, TagSession
+
+
+def make_mp3(path):
+    path.write_bytes((b"\xff\xfb\x90\x64" + b"\0" * 413) * 40)
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text="el choclo"))
+    tags.add(TPUB(encoding=3, text="Victor"))
+    tags.save(path, v2_version=3)
+
+
+def make_flac(path):
+    sample_rate, channels, bits, samples = 44100, 2, 16, 441000
+    info = struct.pack(">HH", 4096, 4096) + b"\0" * 6
+    info += ((sample_rate << 44) | ((channels - 1) << 41) | ((bits - 1) << 36) | samples).to_bytes(8, "big")
+    info += b"\0" * 16
+    path.write_bytes(b"fLaC" + bytes([0x80]) + len(info).to_bytes(3, "big") + info + b"\xff\xf8" + b"\0" * 100)
+    audio = FLAC(path)
+    audio["label"] = "Victor"  # an existing label is moved to remixer on the first run
+    audio["title"] = "el choclo"
+    audio.save()
+
+
+def atom(name, payload):
+    return struct.pack(">I", 8 + len(payload)) + name + payload
+
+
+def make_mp4(path):
+    mvhd = atom(b"mvhd", b"\0" * 4 + struct.pack(">IIII", 0, 0, 1000, 10000) + b"\0" * 80)
+    mdhd = atom(b"mdhd", b"\0" * 4 + struct.pack(">IIII", 0, 0, 44100, 441000) + b"\0" * 4)
+    hdlr = atom(b"hdlr", b"\0" * 8 + b"soun" + b"\0" * 13)
+    trak = atom(b"trak", atom(b"mdia", mdhd + hdlr))
+    path.write_bytes(atom(b"ftyp", b"M4A \0\0\0\0M4A mp42isom") + atom(b"moov", mvhd + trak)
+                     + atom(b"mdat", b"\0" * 100))
+    audio = MP4(path)
+    audio.add_tags()
+    audio["©nam"] = ["el choclo"]
+    audio.save()
+
+
+def make_aiff(path):
+    rate = b"\x40\x0e\xac\x44" + b"\0" * 6  # 44100 Hz as an 80-bit float
+    comm = b"COMM" + struct.pack(">I", 18) + struct.pack(">hIh", 2, 100, 16) + rate
+    ssnd = b"SSND" + struct.pack(">I", 408) + struct.pack(">II", 0, 0) + b"\0" * 400
+    body = b"AIFF" + comm + ssnd
+    path.write_bytes(b"FORM" + struct.pack(">I", len(body)) + body)
+    audio = AIFF(path)
+    audio.add_tags()
+    audio.tags.add(TIT2(encoding=3, text="el choclo"))
+    audio.save()
+
+
+# Catalogue rows often have no composer, grouping, label or genre
+FULL = MetaData(title="El Choclo", orchestra="Juan D'Arienzo", genre="Tango", year="1937",
+                label="Victor", composer="Angel Villoldo", grouping="Guardia Nueva",
+                singer="Instrumental", pianist="Rodolfo Biagi")
+SPARSE = MetaData(title="El Choclo", orchestra="Juan D'Arienzo", genre="", year="1937")
+
+
+@pytest.mark.parametrize("meta", [FULL, SPARSE], ids=["full", "sparse"])
+@pytest.mark.parametrize("make, name", [(make_mp3, "a.mp3"), (make_flac, "a.flac"),
+                                        (make_mp4, "a.m4a"), (make_aiff, "a.aiff")],
+                         ids=["mp3", "flac", "mp4", "aiff"])
+def test_second_apply_is_no_change(tmp_path, make, name, meta):
+    path = tmp_path / name
+    make(path)
+
+    session = TagSession(path)
+    assert session.apply(meta)
+    session.save()
+
+    assert not TagSession(path).apply(meta)
@@ -46,7 +46,22 @@ a = Analysis(
     datas=[
         # Include metadata parquet files
         (str(metadata_dir / "parquet_files"), "metadata/parquet_files"),
-    ] + rapidfuzz_datas + (
+    ] + (
+        # Include the partitioned catalogue dataset if it has been built
+        [(str(metadata_dir / "catalogue_dataset"), "metadata/catalogue_dataset")]
+        if (metadata_dir / "catalogue_dataset").exists()
+        else []
+    ) + (
+        # Include the memory-mapped Arrow catalogue if it has been built
+        [(str(metadata_dir / "catalogue.arrow"), "metadata")]
+        if (metadata_dir / "catalogue.arrow").exists()
+        else []
+    ) + (
+        # Include the SQLite catalogue backend if it has been built
+        [(str(metadata_dir / "catalogue.sqlite"), "metadata")]
+        if (metadata_dir / "catalogue.sqlite").exists()
+        else []
+    ) + rapidfuzz_datas + (
         # Include config file if it exists
         [(str(tigertag_dir / "tigertag_config.json"), "tigertag")] 
         if (tigertag_dir / "tigertag_config.json").exists() 
@@ -91,6 +106,13 @@ a = Analysis(
         'helper_functions',
         'tag_updater',
         'vdj_updater',
+        'catalogue_index',
+        'catalogue_db',
+        'header_tags',
+        'journal',
+        'rename_planner',
+        'match_cache',
+        'cli',
     ] + rapidfuzz_hiddenimports,
     hookspath=[],
     hooksconfig={},